@@ -0,0 +1,181 @@
+from PIL import Image
+import heapq
+import io
+import itertools
+import threading
+import time
+
+# Leading bytes of each supported container format
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+)
+
+
+class AdmissionError(Exception):
+    """A request refused before decoding; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+
+def sniff_image_format(header):
+    """Identify PNG, JPEG or WebP from the first bytes of a file, or return None."""
+    for signature, pil_format in _SIGNATURES:
+        if header.startswith(signature):
+            return pil_format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def probe_image(source):
+    """Read just the magic bytes and image header and return (format, size, mode).
+
+    source may be bytes or a seekable file object, which is left at its start position.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    start = source.tell()
+    try:
+        if sniff_image_format(source.read(16)) is None:
+            raise AdmissionError('Unsupported file type', 415)
+        source.seek(start)
+        try:
+            # Image.open parses the header only; pixel data is not decoded until load()
+            with Image.open(source) as image:
+                return image.format, image.size, image.mode
+        except Image.DecompressionBombError as e:
+            raise AdmissionError(str(e), 413) from e
+        except Exception as e:
+            raise AdmissionError(f'Unreadable image: {e}', 415) from e
+    finally:
+        source.seek(start)
+
+
+def decoded_bytes(size, mode):
+    """Estimate the memory a decode plus one full-size output buffer of this image needs."""
+    width, height = size
+    # Pillow stores every multi-band and 32-bit mode in four bytes per pixel
+    bytes_per_pixel = 1 if mode in ('1', 'L', 'P') else 4
+    return width * height * bytes_per_pixel * 2
+
+
+class MemoryBudget:
+    """Global budget of decoded image memory shared by concurrent conversions.
+
+    Requests that do not fit wait up to max_wait seconds for others to finish,
+    then are refused with 503 so a burst of huge images cannot exhaust the worker.
+    """
+
+    def __init__(self, capacity, max_wait=5.0, retry_after=5):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_use = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, amount):
+        if amount > self.capacity:
+            raise AdmissionError('Image too large to process', 413)
+        deadline = time.monotonic() + self.max_wait
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.in_use + amount > self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionError('Server busy, try again later', 503, retry_after=self.retry_after)
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_use += amount
+
+    def release(self, amount):
+        with self._cond:
+            self.in_use -= amount
+            self._cond.notify_all()
+
+    def reserve(self, amount):
+        """Context manager holding amount of the budget for the duration of the block."""
+        return _Reservation(self, amount)
+
+
+class _Reservation:
+    def __init__(self, budget, amount):
+        self.budget = budget
+        self.amount = amount
+
+    def __enter__(self):
+        self.budget.acquire(self.amount)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.budget.release(self.amount)
+
+
+class ConcurrencyLimiter:
+    """Caps the requests a route runs at once, with a bounded queue for the rest.
+
+    Up to `limit` callers run concurrently and up to `max_queue` more wait. A caller that
+    finds the queue full, or that waits longer than max_wait seconds, is refused with 503.
+
+    With priority_rate (bytes per second) set, waiters are ordered as if each had arrived
+    cost / priority_rate seconds later than it did, so small requests overtake large
+    ones, but only by a bounded amount. Without it the queue is first come, first served.
+    """
+
+    def __init__(self, limit, max_queue, max_wait=30.0, retry_after=5, priority_rate=None):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.priority_rate = priority_rate
+        self.active = 0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def acquire(self, cost=0):
+        """Wait for a slot and return the seconds spent waiting."""
+        start = time.monotonic()
+        with self._cond:
+            if self.active < self.limit and not self._queue:
+                self.active += 1
+                return 0.0
+            if len(self._queue) >= self.max_queue:
+                raise AdmissionError('Server busy, try again later', 503, retry_after=self.retry_after)
+
+            priority = start + (cost / self.priority_rate if self.priority_rate else 0)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            deadline = start + self.max_wait
+            try:
+                while self.active >= self.limit or self._queue[0] != entry:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionError('Server busy, try again later', 503, retry_after=self.retry_after)
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self.active += 1
+            # The next waiter may fit too if several slots freed at once
+            self._cond.notify_all()
+        return time.monotonic() - start
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
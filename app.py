@@ -1,30 +1,803 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Request, Response, current_app, g, render_template, request, send_file, jsonify, stream_with_context
 from flask_cors import CORS
-from PIL import Image
 import os
-from PyPDF2 import PdfMerger, PdfReader, PdfWriter
 import io
+import re
+import hmac
+import cProfile
+import pstats
+import uuid
+import contextlib
+import functools
 import subprocess
 import tempfile
+import threading
+import time
 import shutil
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from caching import DiskCache, ResultCache, SingleFlight, file_digest, make_key
+from imaging import (EXTENSION_MAP, FORMAT_MAP, MIMETYPE_MAP, PROFILES, convert_image_auto, convert_image_data,
+                     convert_image_file, render_renditions, save_kwargs_for)
+import ghostscript
+from pdfs import compress_pdf_smaller, merge_pdf_files
+from jobs import JobManager, JobQueueFull
+from admission import AdmissionError, ConcurrencyLimiter, MemoryBudget, decoded_bytes, probe_image
+from metrics import Registry
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+class SpoolingRequest(Request):
+    """Request that streams file uploads chunk by chunk into UPLOAD_FOLDER.
+
+    Small bodies stay in memory; anything larger is written to a named temp file so
+    handlers can hand its path to Ghostscript or PyPDF2 without another copy. The
+    files are removed when the request is closed.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= current_app.config['UPLOAD_SPOOL_THRESHOLD']:
+            return io.BytesIO()
+        stream = tempfile.NamedTemporaryFile(
+            'wb+', dir=current_app.config['UPLOAD_FOLDER'], prefix='upload-', suffix='.part', delete=False
+        )
+        if not hasattr(self, '_spooled_paths'):
+            self._spooled_paths = []
+        self._spooled_paths.append(stream.name)
+        return stream
+
+    @property
+    def max_content_length(self):
+        """body_limit() for this route; Werkzeug checks it against Content-Length before parsing the body."""
+        return body_limit(self.path)
+
+    def close(self):
+        super().close()
+        for path in getattr(self, '_spooled_paths', ()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def body_limit(path):
+    """The request body limit for path: its ROUTE_MAX_CONTENT_LENGTH if it has one, else MAX_CONTENT_LENGTH."""
+    return app.config['ROUTE_MAX_CONTENT_LENGTH'].get(path, app.config['MAX_CONTENT_LENGTH'])
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 CORS(app)  # Enable CORS for all routes
 app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # 512MB max upload, spooled to disk
+app.config['ROUTE_MAX_CONTENT_LENGTH'] = {  # lower body limits for routes that decode uploads in memory
+    '/convert-image': 16 * 1024 * 1024,
+    '/jobs/convert-image': 16 * 1024 * 1024,
+    '/convert-images': 128 * 1024 * 1024,  # members are read one at a time, each up to the /convert-image limit
+}
+app.config['UPLOAD_SPOOL_THRESHOLD'] = 512 * 1024  # request bodies up to 512KB stay in memory
+app.config['IMAGE_CACHE_MAX_BYTES'] = 64 * 1024 * 1024  # 64MB of cached conversion results
+app.config['PDF_CACHE_MAX_BYTES'] = 1024 * 1024 * 1024  # 1GB of compressed and merged PDFs on disk, shared by all workers
+app.config['GHOSTSCRIPT'] = ghostscript.find_ghostscript()  # resolved once at startup
+app.config['GS_POOL_SIZE'] = 0  # persistent gs workers per process (experimental); 0 runs one gs per request
+app.config['GS_POOL_MAX_JOBS'] = 50  # recycle each gs worker after this many jobs
+app.config['GS_SHARDS'] = 1  # gs processes per large PDF; 1 disables sharding
+app.config['GS_SHARD_PROCESSES'] = os.cpu_count() or 2  # gs processes all sharded compressions in a process share
+app.config['GS_SHARD_PAGES'] = 100  # PDFs of at least twice this many pages are sharded, at least this many pages per shard
+app.config['PDF_MIN_COMPRESSIBLE_SHARE'] = 0.1  # PDFs with less of their size in images, fonts or unfiltered streams are returned as uploaded
+app.config['GHOSTSCRIPT_MODE'] = 'files'  # 'files': work files in UPLOAD_FOLDER; 'pipe': one gs per request, streamed through stdin/stdout
+app.config['IMAGE_PROFILE'] = 'balanced'  # encoder profile when a request names none: fast, balanced, smallest
+app.config['MAX_RENDITIONS'] = 8  # widths one /convert-image request may ask for
+app.config['AUTO_FORMATS'] = ('webp', 'jpg', 'png')  # format=auto candidates when a request lists none
+app.config['AUTO_FORMAT_BUDGET'] = 1.0  # seconds format=auto waits for slower candidates before taking the smallest so far
+app.config['AUTO_FORMAT_THREADS'] = os.cpu_count() or 2  # threads running format=auto trial encodes
+app.config['MAX_IMAGE_PIXELS'] = 50_000_000  # larger images are refused with 413
+app.config['IMAGE_MEMORY_BUDGET'] = 1024 * 1024 * 1024  # decoded image bytes in flight per process
+app.config['IMAGE_ADMISSION_WAIT'] = 5  # seconds to wait for budget before answering 503
+app.config['BATCH_WORKERS'] = os.cpu_count() or 2  # processes encoding /convert-images members
+app.config['JOB_WORKERS'] = 2  # processes running background jobs
+app.config['JOB_RESULT_TTL'] = 600  # seconds a finished job's result is kept
+app.config['JOB_MAX_PENDING'] = 100  # unfinished jobs accepted before answering 503
+app.config['JOB_MAX_AGE'] = 24 * 3600  # seconds after which directories of jobs that never finished are removed
+app.config['ROUTE_LIMITS'] = {  # (running, queued) requests per route and process; more are refused with 503
+    '/convert-image': (2 * (os.cpu_count() or 2), 64),
+    '/convert-images': (2, 8),
+    '/compress-pdf': (os.cpu_count() or 2, 32),
+    '/merge-pdf': (os.cpu_count() or 2, 32),
+}
+app.config['ROUTE_QUEUE_WAIT'] = 30  # seconds a queued request waits for a slot before 503
+app.config['ROUTE_PRIORITY_RATE'] = 10 * 1024 * 1024  # queue order: each 10MB of body counts as arriving 1s later
+app.config['ASYNC_ROUTE_LIMITS'] = {'/convert-image': 8, '/compress-pdf': 2, '/merge-pdf': 2}  # concurrent CPU jobs per route under asgi.py
+app.config['ASYNC_QUEUE_WAIT'] = 30  # seconds asgi.py waits for a free slot before answering 503
+app.config['SERVER_TIMING'] = True  # add a per-stage Server-Timing header to conversion responses
+app.config['ADMIN_TOKEN'] = os.environ.get('SPOTCONVERT_ADMIN_TOKEN')  # enables ?profile=1; unset disables it
+app.config['PROFILE_MAX_DUMPS'] = 20  # newest ?profile=1 dumps kept per upload folder; older ones are removed
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+PROFILE_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles')
+
+# Converted images keyed by input hash, target format and encoder settings
+image_cache = ResultCache(app.config['IMAGE_CACHE_MAX_BYTES'])
+# Compressed and merged PDFs keyed by input hashes and settings, in files any worker can serve
+pdf_cache = DiskCache(os.path.join(app.config['UPLOAD_FOLDER'], 'cache'), app.config['PDF_CACHE_MAX_BYTES'])
+# Identical conversions in flight at once run once: images within a process, PDFs across
+# worker processes too, by locking the key and re-checking pdf_cache
+image_flights = SingleFlight()
+pdf_flights = SingleFlight(os.path.join(app.config['UPLOAD_FOLDER'], 'locks'))
+
+# Decoded pixels in flight across all image conversions in this process
+image_budget = MemoryBudget(app.config['IMAGE_MEMORY_BUDGET'], max_wait=app.config['IMAGE_ADMISSION_WAIT'])
+# Also guards decodes in pool processes, which skip the admission check
+Image.MAX_IMAGE_PIXELS = app.config['MAX_IMAGE_PIXELS']
+
+# Sharded compressions in this process draw their gs processes from here
+shard_slots = threading.BoundedSemaphore(app.config['GS_SHARD_PROCESSES'])
+
+# Concurrency caps with a bounded, small-first wait queue for the expensive routes
+route_limiters = {
+    route: ConcurrencyLimiter(limit, max_queue, max_wait=app.config['ROUTE_QUEUE_WAIT'],
+                              priority_rate=app.config['ROUTE_PRIORITY_RATE'])
+    for route, (limit, max_queue) in app.config['ROUTE_LIMITS'].items()
+}
+
+# Background conversions submitted through /jobs
+job_manager = JobManager(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'),
+    max_workers=app.config['JOB_WORKERS'],
+    ttl=app.config['JOB_RESULT_TTL'],
+    max_pending=app.config['JOB_MAX_PENDING'],
+    max_age=app.config['JOB_MAX_AGE']
+)
+
+# Served on /metrics in the Prometheus text format. Values are per process: under a
+# multi-worker server each worker reports its own, so scrape or aggregate accordingly.
+metrics = Registry()
+REQUESTS = metrics.counter('spotconvert_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+REQUEST_SECONDS = metrics.histogram('spotconvert_request_duration_seconds', 'Time spent handling a request.', ('route',))
+REQUEST_BYTES = metrics.counter('spotconvert_request_bytes_total', 'Request body bytes received.', ('route',))
+RESPONSE_BYTES = metrics.counter('spotconvert_response_bytes_total', 'Response body bytes sent.', ('route',))
+IN_FLIGHT = metrics.gauge('spotconvert_requests_in_flight', 'Requests currently being handled.', ('route',))
+IMAGE_STAGE_SECONDS = metrics.histogram('spotconvert_image_stage_seconds', 'Time per image conversion stage.', ('stage',))
+GHOSTSCRIPT_SECONDS = metrics.histogram('spotconvert_ghostscript_seconds', 'Wall time of Ghostscript compressions.')
+GHOSTSCRIPT_RUNS = metrics.counter('spotconvert_ghostscript_runs_total', 'Ghostscript compressions by exit code.', ('exit_code',))
+PDF_COMPRESSIONS = metrics.counter('spotconvert_pdf_compressions_total', 'PDF compressions by engine.', ('engine',))
+PDF_UNCHANGED = metrics.counter('spotconvert_pdf_unchanged_total',
+                                'PDFs returned as uploaded: skipped by the pre-scan, or output not smaller.',
+                                ('outcome',))
+QUEUE_DEPTH = metrics.gauge('spotconvert_queue_depth', 'Requests waiting for a route slot.', ('route',))
+QUEUE_WAIT_SECONDS = metrics.histogram('spotconvert_queue_wait_seconds', 'Time requests waited for a route slot.', ('route',))
+SHED = metrics.counter('spotconvert_shed_total', 'Requests refused with 503 because a route was saturated.', ('route',))
+ROUTE_ACTIVE = metrics.gauge('spotconvert_route_active', 'Requests holding a route slot.', ('route',))
+COALESCED = metrics.counter('spotconvert_coalesced_total',
+                            'Requests answered by an identical conversion that was already running.', ('route',))
+MERGE_SECONDS = metrics.histogram('spotconvert_merge_seconds', 'Time to merge PDFs, reading plus writing.')
+MERGE_PAGES = metrics.histogram('spotconvert_merge_pages', 'Pages in each merged PDF.',
+                                buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000))
+
+_gs_pool = None
+_gs_pool_lock = threading.Lock()
+
+def ghostscript_pool():
+    """Return this process's Ghostscript worker pool, creating it on first use."""
+    global _gs_pool
+    if not app.config['GHOSTSCRIPT'] or app.config['GS_POOL_SIZE'] <= 0:
+        return None
+    with _gs_pool_lock:
+        # Workers are tied to the process that spawned them, so rebuild after fork
+        if _gs_pool is None or _gs_pool.pid != os.getpid():
+            _gs_pool = ghostscript.GhostscriptPool(
+                app.config['GHOSTSCRIPT'],
+                size=app.config['GS_POOL_SIZE'],
+                max_jobs=app.config['GS_POOL_MAX_JOBS'],
+                workdir=app.config['UPLOAD_FOLDER']
+            )
+        return _gs_pool
+
+_batch_executor = None
+_batch_executor_pid = None
+
+def batch_executor():
+    """Return this process's pool for batch image conversion, creating it on first use."""
+    global _batch_executor, _batch_executor_pid
+    with _gs_pool_lock:
+        if _batch_executor is None or _batch_executor_pid != os.getpid():
+            _batch_executor = ProcessPoolExecutor(max_workers=app.config['BATCH_WORKERS'])
+            _batch_executor_pid = os.getpid()
+        return _batch_executor
+
+_trial_executor = None
+_trial_executor_pid = None
+
+def trial_executor():
+    """Return this process's thread pool for format=auto trial encodes, creating it on first use."""
+    global _trial_executor, _trial_executor_pid
+    with _gs_pool_lock:
+        if _trial_executor is None or _trial_executor_pid != os.getpid():
+            _trial_executor = ThreadPoolExecutor(max_workers=app.config['AUTO_FORMAT_THREADS'])
+            _trial_executor_pid = os.getpid()
+        return _trial_executor
+
+def shutdown_pools():
+    """Stop the Ghostscript workers and process pools this process started."""
+    global _gs_pool, _batch_executor, _trial_executor
+    with _gs_pool_lock:
+        if _gs_pool is not None and _gs_pool.pid == os.getpid():
+            _gs_pool.close()
+        if _batch_executor is not None and _batch_executor_pid == os.getpid():
+            _batch_executor.shutdown(wait=False, cancel_futures=True)
+        if _trial_executor is not None and _trial_executor_pid == os.getpid():
+            _trial_executor.shutdown(wait=False, cancel_futures=True)
+        _gs_pool = _batch_executor = _trial_executor = None
+    job_manager.shutdown()
 
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 ALLOWED_PDF_EXTENSIONS = {'pdf'}
 
+def upload_path(file, directory, name):
+    """Return a path holding the upload, copying it into directory only if it was kept in memory."""
+    path = getattr(file.stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        file.stream.flush()
+        return os.path.abspath(path)
+
+    path = os.path.abspath(os.path.join(directory, name))
+    file.stream.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(file.stream, f)
+    return path
+
+def upload_size(file):
+    """Size in bytes of an uploaded file, without reading it."""
+    position = file.stream.tell()
+    size = file.stream.seek(0, os.SEEK_END)
+    file.stream.seek(position)
+    return size
+
+def save_upload(file, path):
+    """Move the upload to path, renaming the spooled temp file instead of copying when possible."""
+    spooled = getattr(file.stream, 'name', None)
+    if isinstance(spooled, str) and os.path.isfile(spooled):
+        file.stream.close()
+        os.replace(spooled, path)
+    else:
+        file.save(path)
+
+def compress_cache_key(path, level):
+    """pdf_cache key for compressing the PDF at path at level with the engine this server runs."""
+    return make_key(file_digest(path).encode(), 'compress-pdf', level,
+                    'ghostscript' if app.config['GHOSTSCRIPT'] else 'pypdf2')
+
+def merge_cache_key(paths):
+    """pdf_cache key for merging the PDFs at paths, in order."""
+    return make_key(b'', 'merge-pdf', [file_digest(path) for path in paths])
+
+def send_and_remove(path, directory, **kwargs):
+    """send_file the file at path and delete directory right away.
+
+    send_file has opened the file by then, and the open file stays readable after it is
+    unlinked. The response keeps its direct passthrough, so a server providing
+    wsgi.file_wrapper (Gunicorn) sends it with sendfile instead of copying it through Python.
+    """
+    response = send_file(path, **kwargs)
+    if os.name == 'nt':
+        # Open files cannot be deleted on Windows
+        return remove_after_response(response, directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    return response
+
+def remove_after_response(response, path):
+    """Delete the directory at path once the response body has been sent."""
+    # Passthrough responses never reach Response.close(), so let Werkzeug iterate the body
+    response.direct_passthrough = False
+    response.call_on_close(lambda: shutil.rmtree(path, ignore_errors=True))
+    return response
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable sink; zipfile then emits data descriptors as it goes."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries):
+    """Yield a ZIP archive of (name, bytes) entries piece by piece as the entries arrive."""
+    sink = _ZipSink()
+    # Members are already-compressed images, so store rather than deflate them
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+def parse_dimension(value):
+    """Parse an optional pixel size form field; raises ValueError unless it is a positive integer."""
+    if value is None or value == '':
+        return None
+    size = int(value)
+    if size <= 0:
+        raise ValueError(value)
+    return size
+
+def admit_image(source):
+    """Validate an image from its magic bytes and header and return its decode memory estimate.
+
+    Raises AdmissionError for non-images and for images over MAX_IMAGE_PIXELS.
+    """
+    _, size, mode = probe_image(source)
+    if size[0] * size[1] > app.config['MAX_IMAGE_PIXELS']:
+        raise AdmissionError(f'Image of {size[0]}x{size[1]} pixels exceeds the pixel limit', 413)
+    return decoded_bytes(size, mode)
+
 def allowed_image_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
 
 def allowed_pdf_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_PDF_EXTENSIONS
 
+for _route, _limiter in route_limiters.items():
+    QUEUE_DEPTH.set_function(_route, func=lambda limiter=_limiter: limiter.depth)
+    ROUTE_ACTIVE.set_function(_route, func=lambda limiter=_limiter: limiter.active)
+
+def route_label():
+    # The URL rule rather than the path, so /jobs/<id> and unknown URLs stay one series each
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+class _CountingBody:
+    """Wraps a streamed response body and counts bytes as they are sent."""
+
+    def __init__(self, body, route):
+        self.body = body
+        self.route = route
+
+    def __iter__(self):
+        for chunk in self.body:
+            RESPONSE_BYTES.inc(self.route, amount=len(chunk))
+            yield chunk
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+# cProfile hooks into the interpreter globally, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+def is_admin():
+    token = app.config['ADMIN_TOKEN']
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+@contextlib.contextmanager
+def timed(stage, into=None):
+    """Add the time spent in the block to stage in into, by default this request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timings({stage: time.perf_counter() - start}, into)
+
+def add_timings(timings, into=None):
+    into = g.timings if into is None else into
+    for stage, seconds in timings.items():
+        into[stage] = into.get(stage, 0.0) + seconds
+
+def server_timing_header(timings, total):
+    entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.timings = {}
+    g.route = route_label()
+    IN_FLIGHT.inc(g.route)
+    if request.content_length:
+        REQUEST_BYTES.inc(g.route, amount=request.content_length)
+
+def acquire_route_slot():
+    """Wait for one of this route's slots and return a function that gives it back.
+
+    Handlers call this once the upload has been parsed and checked, so requests still
+    receiving their body, or refused for a bad form, never hold or queue for a slot.
+    """
+    limiter = route_limiters.get(g.route)
+    if limiter is None:
+        return lambda: None
+    try:
+        waited = limiter.acquire(request.content_length or 0)
+    except AdmissionError:
+        SHED.inc(g.route)
+        raise
+    QUEUE_WAIT_SECONDS.observe(g.route, value=waited)
+    if waited:
+        add_timings({'queue': waited})
+    return functools.partial(_release_once, limiter, [False])
+
+def _release_once(limiter, released):
+    if not released[0]:
+        released[0] = True
+        limiter.release()
+
+@contextlib.contextmanager
+def route_slot():
+    """Hold one of this route's slots for the CPU work in the block."""
+    release = acquire_route_slot()
+    try:
+        yield
+    finally:
+        release()
+
+@app.before_request
+def start_profile():
+    if request.args.get('profile') != '1' or not is_admin():
+        return
+    if not _profile_lock.acquire(blocking=False):
+        g.profile_id = None
+        return
+    g.profile_id = uuid.uuid4().hex
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+@app.after_request
+def record_response_metrics(response):
+    if 'request_start' in g:
+        g.status = response.status_code
+        if response.content_length is not None:
+            RESPONSE_BYTES.inc(g.route, amount=response.content_length)
+        else:
+            response.response = _CountingBody(response.response, g.route)
+        if g.timings and app.config['SERVER_TIMING']:
+            # Streamed bodies are still being sent, so total covers the handler only
+            response.headers['Server-Timing'] = server_timing_header(
+                g.timings, time.perf_counter() - g.request_start
+            )
+    if 'profile_id' in g:
+        if g.profile_id is None:
+            response.headers['X-Profile'] = 'busy'
+        else:
+            response.headers['X-Profile'] = f'/profiles/{g.profile_id}'
+    return response
+
+def prune_profiles(keep):
+    """Remove all but the newest keep profile dumps, which any worker process may have written."""
+    dumps = []
+    for entry in os.scandir(PROFILE_FOLDER):
+        if entry.name.endswith('.prof'):
+            try:
+                dumps.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                continue
+    dumps.sort(reverse=True)
+    for _, path in dumps[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another worker pruned it first
+            pass
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Runs once the request context is popped, i.e. after streamed bodies have been sent
+    # g outlives the request when an app context was already pushed, so clear what we set
+    profile_id = g.pop('profile_id', None)
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        try:
+            os.makedirs(PROFILE_FOLDER, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_FOLDER, f'{profile_id}.prof'))
+            prune_profiles(app.config['PROFILE_MAX_DUMPS'])
+        finally:
+            _profile_lock.release()
+
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    REQUEST_SECONDS.observe(g.route, value=time.perf_counter() - start)
+    REQUESTS.inc(g.route, request.method, g.pop('status', 500))
+    IN_FLIGHT.dec(g.route)
+
+def observe_image_stages(timings, into=None):
+    for stage, seconds in timings.items():
+        IMAGE_STAGE_SECONDS.observe(stage, value=seconds)
+    add_timings(timings, into)
+
+class RequestError(Exception):
+    """A conversion request refused for its form or upload; both servers answer {'error': message}."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def single_upload(files, allowed):
+    """Return the upload of a one-file field, or raise RequestError."""
+    if not files:
+        raise RequestError('No file uploaded')
+    file = files[0]
+    if file.filename == '':
+        raise RequestError('No file selected')
+    if not allowed(file.filename):
+        raise RequestError('Unsupported file type', 415)
+    return file
+
+def merge_uploads(files):
+    """Return the uploads of a merge request, or raise RequestError."""
+    if not files:
+        raise RequestError('No files uploaded')
+    if files[0].filename == '':
+        raise RequestError('No files selected')
+    for file in files:
+        if not allowed_pdf_file(file.filename):
+            raise RequestError(f'Invalid file type: {file.filename}')
+    return files
+
+def _call_timed(func, *args, **kwargs):
+    timings = {}
+    return func(*args, timings=timings, **kwargs), timings
+
+def run_timed(executor, func, *args, **kwargs):
+    """Call func(*args, timings=..., **kwargs) on executor, or here without one.
+
+    Returns (result, timings); the timings dict comes back from pool processes too.
+    """
+    if executor is None:
+        return _call_timed(func, *args, **kwargs)
+    return executor.submit(_call_timed, func, *args, **kwargs).result()
+
+class ConversionResult:
+    """What a conversion route sends: bytes, zip entries or a file at path, with its name and headers."""
+
+    def __init__(self, mimetype, filename, body=None, entries=None, path=None, headers=None):
+        self.mimetype = mimetype
+        self.filename = filename
+        self.body = body
+        self.entries = entries
+        self.path = path
+        self.headers = headers or {}
+
+# The request classes below are shared by the Flask routes and asgi.py. Each is built
+# from a request's fields and stage timings dict; cached() answers from the caches
+# without a route slot, and on a miss run() converts, taking slot() around the CPU work
+# only. Identical conversions in flight are coalesced inside run(). With executor, a
+# process pool, the Pillow or PyPDF2 work runs there instead of in the calling thread.
+
+class ImageConversion:
+    """A /convert-image request: validates the form (RequestError) and converts an upload."""
+
+    def __init__(self, filename, form, timings):
+        try:
+            self.width = parse_dimension(form.get('width'))
+            self.height = parse_dimension(form.get('height'))
+            # Repeated widths would give repeated archive members for the same work
+            self.widths = sorted({parse_dimension(w) for w in (form.get('widths') or '').split(',') if w.strip()})
+        except ValueError:
+            raise RequestError('Sizes must be positive integers') from None
+        if len(self.widths) > app.config['MAX_RENDITIONS']:
+            raise RequestError(f"At most {app.config['MAX_RENDITIONS']} widths are allowed")
+
+        profile = form.get('profile') or app.config['IMAGE_PROFILE']
+        if profile not in PROFILES:
+            raise RequestError(f'Unknown profile: {profile}')
+
+        self.target = (form.get('format') or '').lower()
+        if self.target == 'auto':
+            if self.widths:
+                raise RequestError('format=auto cannot be combined with widths')
+            try:
+                pil_formats = auto_candidates(form.get('formats'))
+            except ValueError as e:
+                raise RequestError(f'Unsupported format in formats: {e}') from None
+        elif self.target in FORMAT_MAP:
+            pil_formats = [FORMAT_MAP[self.target]]
+        else:
+            raise RequestError('Unsupported target format')
+        self.candidates = [(pil_format, save_kwargs_for(pil_format, profile)) for pil_format in pil_formats]
+
+        self.base = os.path.splitext(filename)[0] or 'converted'
+        self.timings = timings
+        self.data = None
+        self.memory = None
+
+    def _key(self, pil_format, save_kwargs):
+        return make_key(self.data, pil_format, save_kwargs, self.width, self.height)
+
+    def _result(self, pil_format, converted, cache_status):
+        extension = self.target if self.target != 'auto' else EXTENSION_MAP[pil_format]
+        headers = {'X-Cache': cache_status}
+        if self.target == 'auto':
+            headers['X-Image-Format'] = extension
+        return ConversionResult(MIMETYPE_MAP[extension], f'{self.base}.{extension}', body=converted, headers=headers)
+
+    def cached(self, data):
+        """Admit the upload, then return its conversion from the result cache, or None."""
+        self.data = data
+        # Sniff and read only the header
+        with timed('admit', self.timings):
+            self.memory = admit_image(data)
+        if self.widths:
+            return None
+        # Identical uploads with identical encoder settings produce identical bytes
+        with timed('cache', self.timings):
+            if self.target == 'auto':
+                # The winning format is cached by name and its bytes under the usual
+                # per-format key, so a later explicit request for that format hits the same entry
+                choice = image_cache.get(self._key('auto', self.candidates))
+                if choice is None:
+                    return None
+                pil_format = choice.decode()
+                converted = image_cache.get(self._key(pil_format, dict(self.candidates)[pil_format]))
+            else:
+                pil_format, save_kwargs = self.candidates[0]
+                converted = image_cache.get(self._key(pil_format, save_kwargs))
+        return None if converted is None else self._result(pil_format, converted, 'HIT')
+
+    def run(self, executor=None, slot=contextlib.nullcontext):
+        if self.widths:
+            return self._renditions(executor, slot)
+        if self.target == 'auto':
+            # Keyed like the cached choice of format, so identical auto requests share one set of trials
+            (pil_format, converted), coalesced = image_flights.do(self._key('auto', self.candidates),
+                                                                  self._smallest, slot)
+        else:
+            pil_format, save_kwargs = self.candidates[0]
+            converted, coalesced = image_flights.do(self._key(pil_format, save_kwargs), self._convert,
+                                                    pil_format, save_kwargs, executor, slot)
+        if coalesced:
+            COALESCED.inc('/convert-image')
+        return self._result(pil_format, converted, 'COALESCED' if coalesced else 'MISS')
+
+    def _convert(self, pil_format, save_kwargs, executor, slot):
+        """Convert within the decode budget and cache the result."""
+        with slot():
+            with timed('wait', self.timings):
+                image_budget.acquire(self.memory)
+            try:
+                converted, timings = run_timed(executor, convert_image_data, self.data, pil_format, save_kwargs,
+                                               width=self.width, height=self.height)
+            finally:
+                image_budget.release(self.memory)
+        observe_image_stages(timings, self.timings)
+        image_cache.put(self._key(pil_format, save_kwargs), converted)
+        return converted
+
+    def _renditions(self, executor, slot):
+        """Decode once and return every width's rendition in one archive."""
+        pil_format, save_kwargs = self.candidates[0]
+        with slot(), image_budget.reserve(self.memory):
+            renditions, timings = run_timed(executor, render_renditions, self.data, pil_format, save_kwargs,
+                                            self.widths)
+        observe_image_stages(timings, self.timings)
+        return ConversionResult(
+            'application/zip', f'{self.base}-renditions.zip',
+            entries=[(f'{self.base}-{w}.{self.target}', converted) for w, converted in renditions]
+        )
+
+    def _smallest(self, slot):
+        """Encode every candidate format and return (pil_format, bytes) of the smallest."""
+        # The decoded image plus one prepared copy per candidate, held until the last trial ends
+        reserved = self.memory // 2 * (len(self.candidates) + 1)
+        timings = {}
+        executor = trial_executor()
+        with slot():
+            with timed('wait', self.timings):
+                image_budget.acquire(reserved)
+            # convert_image_auto calls settled on every path, including a failed submit
+            pil_format, converted = convert_image_auto(
+                self.data, self.candidates, executor, width=self.width, height=self.height,
+                time_budget=app.config['AUTO_FORMAT_BUDGET'], timings=timings,
+                settled=lambda: image_budget.release(reserved)
+            )
+        observe_image_stages(timings, self.timings)
+        image_cache.put(self._key('auto', self.candidates), pil_format.encode())
+        image_cache.put(self._key(pil_format, dict(self.candidates)[pil_format]), converted)
+        return pil_format, converted
+
+class PdfCompression:
+    """A /compress-pdf request compressing the upload at in_path into out_path (files mode)."""
+
+    def __init__(self, in_path, out_path, level, timings):
+        self.in_path = in_path
+        self.out_path = out_path
+        self.level = level
+        self.timings = timings
+        self.cache_key = None
+
+    def cached(self):
+        with timed('cache', self.timings):
+            self.cache_key = compress_cache_key(self.in_path, self.level)
+            hit = pdf_cache.get(self.cache_key, self.out_path)
+        return self._cached_result('HIT') if hit else None
+
+    def _cached_result(self, cache_status):
+        # Cached results are never larger than their input, and equal in size only when unchanged
+        smaller = os.path.getsize(self.out_path) < os.path.getsize(self.in_path)
+        return self._result(None, 'compressed' if smaller else 'original', None, cache_status)
+
+    def run(self, executor=None, slot=contextlib.nullcontext):
+        # executor is unused: gs runs in its own processes, and without it the page copy
+        # stays here while embedded images are re-encoded on the batch pool
+        with pdf_flights.lock(self.cache_key):
+            # Another request may have compressed the same upload while we waited
+            if pdf_cache.get(self.cache_key, self.out_path):
+                COALESCED.inc('/compress-pdf')
+                return self._cached_result('COALESCED')
+            with slot():
+                engine, outcome, share = compress_uploaded_pdf(self.in_path, self.out_path, self.level,
+                                                               self.cache_key, self.timings)
+        return self._result(engine, outcome, share, 'MISS')
+
+    def _result(self, engine, outcome, share, cache_status):
+        if engine == 'ghostscript':
+            GHOSTSCRIPT_RUNS.inc(0)
+        if engine is not None:
+            PDF_COMPRESSIONS.inc(engine)
+        if outcome != 'compressed':
+            PDF_UNCHANGED.inc(outcome)
+        headers = {'X-Compression': outcome, 'X-Cache': cache_status}
+        if share is not None:
+            headers['X-Compressible-Share'] = f'{share:.2f}'
+        return ConversionResult('application/pdf', 'compressed.pdf', path=self.out_path, headers=headers)
+
+class PdfMerge:
+    """A /merge-pdf request merging the uploads at input_paths, in order, into out_path."""
+
+    def __init__(self, input_paths, out_path, timings):
+        self.input_paths = input_paths
+        self.out_path = out_path
+        self.timings = timings
+        self.cache_key = None
+
+    def cached(self):
+        with timed('cache', self.timings):
+            self.cache_key = merge_cache_key(self.input_paths)
+            hit = pdf_cache.get(self.cache_key, self.out_path)
+        return self._result('HIT') if hit else None
+
+    def run(self, executor=None, slot=contextlib.nullcontext):
+        with pdf_flights.lock(self.cache_key):
+            if pdf_cache.get(self.cache_key, self.out_path):
+                COALESCED.inc('/merge-pdf')
+                return self._result('COALESCED')
+            with slot():
+                pages, timings = run_timed(executor, merge_pdf_files, self.input_paths, self.out_path)
+            add_timings(timings, self.timings)
+            MERGE_SECONDS.observe(value=sum(timings.values()))
+            MERGE_PAGES.observe(value=pages)
+            pdf_cache.put(self.cache_key, self.out_path)
+        return self._result('MISS')
+
+    def _result(self, cache_status):
+        return ConversionResult('application/pdf', 'merged.pdf', path=self.out_path, headers={'X-Cache': cache_status})
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_too_large(e):
+    return jsonify({'error': 'Upload too large'}), 413
+
+@app.errorhandler(AdmissionError)
+def handle_admission_error(e):
+    response = jsonify({'error': e.message})
+    response.status_code = e.status
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(RequestError)
+def handle_request_error(e):
+    return jsonify({'error': e.message}), e.status
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -33,196 +806,232 @@ def index():
 def convert_image():
     if request.method == 'OPTIONS':
         return '', 200
-        
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    
-    file = request.files['file']
-    target_format = request.form.get('format')
-    
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-        
-    if not allowed_image_file(file.filename):
-        return jsonify({'error': 'Unsupported file type'}), 415
+
+    # The multipart body is parsed (and large uploads spooled) on first access
+    with timed('upload'):
+        request.files
+    file = single_upload(request.files.getlist('file'), allowed_image_file)
+    conversion = ImageConversion(file.filename, request.form, g.timings)
 
     try:
-        # Open source image
-        image = Image.open(file)
-
-        # Normalize target format name for Pillow
-        fmt_map = {
-            'jpg': 'JPEG',
-            'jpeg': 'JPEG',
-            'png': 'PNG',
-            'webp': 'WEBP'
-        }
-
-        target = target_format.lower()
-        if target not in fmt_map:
-            return 'Unsupported target format', 400
-
-        pil_format = fmt_map[target]
-
-        # Handle transparency when converting to JPEG (no alpha channel)
-        if pil_format == 'JPEG':
-            # If the image has an alpha channel, composite it over white background
-            if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
-                alpha = image.convert('RGBA').split()[-1]
-                bg = Image.new('RGB', image.size, (255, 255, 255))
-                bg.paste(image.convert('RGBA'), mask=alpha)
-                image_out = bg
-            else:
-                image_out = image.convert('RGB')
-        else:
-            # For PNG/WebP keep mode where possible
-            if image.mode == 'P':
-                image_out = image.convert('RGBA') if 'transparency' in image.info else image.convert('RGB')
-            else:
-                image_out = image
-
-        # Save to bytes buffer with sensible quality settings
-        output = io.BytesIO()
-        save_kwargs = {}
-        if pil_format == 'JPEG':
-            save_kwargs.update({'format': 'JPEG', 'quality': 85, 'optimize': True})
-        elif pil_format == 'WEBP':
-            save_kwargs.update({'format': 'WEBP', 'quality': 85})
-        else:
-            save_kwargs.update({'format': pil_format, 'optimize': True})
+        result = conversion.cached(file.read())
+        if result is None:
+            result = conversion.run(slot=route_slot)
+        with timed('send'):
+            return send_result(result)
+    except AdmissionError:
+        raise
+    except Exception as e:
+        return str(e), 500
+
+def send_result(result, directory=None):
+    """Turn a ConversionResult into a Flask response; directory is removed once a file result is sent."""
+    if result.entries is not None:
+        response = Response(stream_zip(result.entries), mimetype=result.mimetype,
+                            headers={'Content-Disposition': f'attachment; filename={result.filename}'})
+    elif result.path is not None:
+        # Stream the result from disk rather than reading it into memory
+        response = send_and_remove(result.path, directory, as_attachment=True, download_name=result.filename,
+                                   mimetype=result.mimetype)
+    else:
+        response = send_file(io.BytesIO(result.body), as_attachment=True, download_name=result.filename,
+                             mimetype=result.mimetype)
+    response.headers.update(result.headers)
+    return response
 
-        # Pillow accepts format as separate arg or in kwargs; use save with kwargs
-        image_out.save(output, **save_kwargs)
-        output.seek(0)
+def auto_candidates(formats):
+    """Parse the formats field of a format=auto request into distinct Pillow formats."""
+    names = [name.strip().lower() for name in formats.split(',') if name.strip()] if formats else []
+    pil_formats = []
+    for name in names or app.config['AUTO_FORMATS']:
+        if name not in FORMAT_MAP:
+            raise ValueError(name)
+        if FORMAT_MAP[name] not in pil_formats:
+            pil_formats.append(FORMAT_MAP[name])
+    return pil_formats
 
-        # Generate output filename using original base name when possible
-        original_name = getattr(file, 'filename', None) or 'converted'
-        base = os.path.splitext(original_name)[0]
-        output_filename = f"{base}.{target}"
+@app.route('/convert-images', methods=['POST', 'OPTIONS'])
+def convert_images():
+    if request.method == 'OPTIONS':
+        return '', 200
 
-        # Set mimetype for response
-        mimetype_map = {'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+    target = (request.form.get('format') or '').lower()
+    if target not in FORMAT_MAP:
+        return jsonify({'error': 'Unsupported target format'}), 400
+    profile = request.form.get('profile') or app.config['IMAGE_PROFILE']
+    if profile not in PROFILES:
+        return jsonify({'error': f'Unknown profile: {profile}'}), 400
+    pil_format = FORMAT_MAP[target]
+    save_kwargs = save_kwargs_for(pil_format, profile)
 
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=output_filename,
-            mimetype=mimetype_map.get(target, f'image/{target}')
-        )
+    if 'archive' in request.files and request.files['archive'].filename != '':
+        archive_file = request.files['archive']
+        try:
+            archive = zipfile.ZipFile(archive_file.stream)
+        except zipfile.BadZipFile:
+            return jsonify({'error': 'Archive is not a valid ZIP file'}), 400
+        sources = [
+            (info.filename, info.file_size, lambda info=info: archive.read(info))
+            for info in archive.infolist() if not info.is_dir()
+        ]
+    else:
+        files = [file for file in request.files.getlist('files[]') if file.filename != '']
+        sources = [(file.filename, upload_size(file), file.read) for file in files]
 
-    except Exception as e:
-        return str(e), 500
+    if not sources:
+        return jsonify({'error': 'No files uploaded'}), 400
+    # Members are converted while the archive streams, so the slot is held until it has been sent
+    release_slot = acquire_route_slot()
+
+    def converted_members():
+        executor = batch_executor()
+        # Bound the uploads held in memory while members wait for a worker
+        max_in_flight = app.config['BATCH_WORKERS'] * 2
+        pending = {}
+        errors = []
+        used_names = set()
+
+        def member_base(source_name):
+            # Member names come from the client: keep them inside the archive's root
+            return os.path.splitext(os.path.basename(secure_filename(source_name)))[0]
+
+        def output_name(source_name):
+            base = member_base(source_name)
+            name = f'{base}.{target}'
+            counter = 1
+            while name in used_names:
+                counter += 1
+                name = f'{base}-{counter}.{target}'
+            used_names.add(name)
+            return name
+
+        def finished(done):
+            for future in done:
+                source_name, cache_key, memory = pending.pop(future)
+                image_budget.release(memory)
+                try:
+                    converted = future.result()
+                except Exception as e:
+                    errors.append(f'{source_name}: {e}')
+                    continue
+                image_cache.put(cache_key, converted)
+                yield output_name(source_name), converted
+
+        try:
+            max_size = app.config['ROUTE_MAX_CONTENT_LENGTH'].get('/convert-image', app.config['MAX_CONTENT_LENGTH'])
+            for source_name, size, read in sources:
+                if not allowed_image_file(source_name):
+                    errors.append(f'{source_name}: Unsupported file type')
+                    continue
+                if not member_base(source_name):
+                    errors.append(f'{source_name}: Invalid file name')
+                    continue
+                if size > max_size:
+                    errors.append(f'{source_name}: File too large')
+                    continue
+                data = read()
+                cache_key = make_key(data, pil_format, save_kwargs, None, None)
+                cached = image_cache.get(cache_key)
+                if cached is not None:
+                    yield output_name(source_name), cached
+                    continue
+                while len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from finished(done)
+                try:
+                    memory = admit_image(data)
+                    image_budget.acquire(memory)
+                except AdmissionError as e:
+                    errors.append(f'{source_name}: {e.message}')
+                    continue
+                try:
+                    future = executor.submit(convert_image_data, data, pil_format, save_kwargs)
+                except BaseException:
+                    image_budget.release(memory)
+                    raise
+                pending[future] = (source_name, cache_key, memory)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+        finally:
+            # The client went away or reading the archive failed: drop queued members and
+            # return each one's budget once its worker is done with it
+            for future, (_, _, memory) in pending.items():
+                future.cancel()
+                future.add_done_callback(lambda _, memory=memory: image_budget.release(memory))
+            pending.clear()
+
+        if errors:
+            yield 'errors.txt', '\n'.join(errors).encode('utf-8')
+
+    # Keep the request (and its spooled uploads) open until the archive has been sent
+    response = Response(
+        stream_with_context(stream_zip(converted_members())),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=converted.zip'}
+    )
+    response.call_on_close(release_slot)
+    return response
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    if not is_admin():
+        return jsonify({'error': 'Admin token required'}), 403
+    path = os.path.join(PROFILE_FOLDER, f'{profile_id}.prof')
+    if not re.fullmatch(r'[0-9a-f]{32}', profile_id) or not os.path.isfile(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'text':
+        # Human-readable summary of the hottest call paths
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats('cumulative').print_stats(50)
+        return Response(out.getvalue(), mimetype='text/plain')
+    # Raw pstats dump for snakeviz, `python -m pstats` and similar tools
+    return send_file(path, as_attachment=True, download_name=f'{profile_id}.prof',
+                     mimetype='application/octet-stream')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype=metrics.content_type)
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({'image': image_cache.stats(), 'pdf': pdf_cache.stats()})
 
 @app.route('/compress-pdf', methods=['POST', 'OPTIONS'])
 def compress_pdf():
     if request.method == 'OPTIONS':
         return '', 200
 
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-        
-    if not allowed_pdf_file(file.filename):
-        return jsonify({'error': 'Unsupported file type'}), 415
+    with timed('upload'):
+        request.files
+    file = single_upload(request.files.getlist('file'), allowed_pdf_file)
 
     # compression level from form: screen, ebook, printer, prepress
     level = request.form.get('level', 'ebook')
 
-    try:
-        # Attempt Ghostscript compression if available for better results
-        gs_exec = shutil.which('gswin64c') or shutil.which('gs') or shutil.which('gswin32c')
-        if gs_exec:
-            # Write uploaded PDF to a temp file
-            with tempfile.TemporaryDirectory() as td:
-                in_path = os.path.join(td, 'in.pdf')
-                out_path = os.path.join(td, 'out.pdf')
-                # Ensure file stream is at beginning
-                file.stream.seek(0)
-                with open(in_path, 'wb') as f:
-                    f.write(file.read())
-
-                # Map level to Ghostscript PDFSETTINGS
-                settings_map = {
-                    'screen': '/screen',   # lowest quality, smallest size
-                    'ebook': '/ebook',     # medium quality
-                    'printer': '/printer', # high quality
-                    'prepress': '/prepress' # highest quality, least compression
-                }
-                pdf_setting = settings_map.get(level, '/ebook')
-
-                # Build Ghostscript command. For more aggressive compression, add explicit
-                # downsampling flags for raster images depending on selected level.
-                gs_cmd = [
-                    gs_exec,
-                    '-sDEVICE=pdfwrite',
-                    '-dCompatibilityLevel=1.4',
-                    f'-dPDFSETTINGS={pdf_setting}',
-                    '-dNOPAUSE', '-dBATCH'
-                ]
-
-                # Add explicit downsampling parameters for non-prepress settings
-                if level in ('screen', 'ebook', 'printer'):
-                    # target DPI per level
-                    dpi_map = {'screen': 72, 'ebook': 100, 'printer': 150}
-                    dpi = dpi_map.get(level, 100)
-                    gs_cmd += [
-                        '-dDownsampleColorImages=true',
-                        '-dDownsampleGrayImages=true',
-                        '-dDownsampleMonoImages=true',
-                        f'-dColorImageResolution={dpi}',
-                        f'-dGrayImageResolution={dpi}',
-                        f'-dMonoImageResolution={dpi}',
-                        '-dColorImageDownsampleType=/Average',
-                        '-dGrayImageDownsampleType=/Average'
-                    ]
-
-                gs_cmd += [f'-sOutputFile={out_path}', in_path]
-
-                # Run Ghostscript and capture output for debugging
-                try:
-                    subprocess.run(gs_cmd, check=True, capture_output=True)
-                except subprocess.CalledProcessError as gs_err:
-                    # include stderr for diagnosis
-                    stderr = gs_err.stderr.decode('utf-8', errors='ignore') if gs_err.stderr else ''
-                    raise RuntimeError(f'Ghostscript failed (rc={gs_err.returncode}): {stderr}') from gs_err
-
-                # Read compressed output
-                with open(out_path, 'rb') as outf:
-                    data = outf.read()
-                output = io.BytesIO(data)
-                output.seek(0)
-
-                return send_file(
-                    output,
-                    as_attachment=True,
-                    download_name='compressed.pdf',
-                    mimetype='application/pdf'
-                )
-
-        # Fallback: attempt PyPDF2 streaming compression (limited)
-        file.stream.seek(0)
-        pdf_reader = PdfReader(file)
-        pdf_writer = PdfWriter()
-        for page in pdf_reader.pages:
-            pdf_writer.add_page(page)
+    if app.config['GHOSTSCRIPT'] and app.config['GHOSTSCRIPT_MODE'] == 'pipe':
+        return compress_pdf_streamed(file, level)
 
-        output = io.BytesIO()
+    try:
+        # Work inside the upload folder, which the persistent Ghostscript workers are
+        # permitted to read and write. Large uploads are already spooled there.
+        td = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
         try:
-            pdf_writer.write(output, compress_streams=True)
-        except TypeError:
-            pdf_writer.write(output)
-        output.seek(0)
-
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='compressed.pdf',
-            mimetype='application/pdf'
-        )
+            with timed('save'):
+                in_path = upload_path(file, td, 'in.pdf')
+            out_path = os.path.abspath(os.path.join(td, 'out.pdf'))
+            compression = PdfCompression(in_path, out_path, level, g.timings)
+            result = compression.cached() or compression.run(slot=route_slot)
+            with timed('send'):
+                response = send_result(result, td)
+        except Exception:
+            shutil.rmtree(td, ignore_errors=True)
+            raise
+        return response
 
+    except AdmissionError:
+        raise
     except Exception as e:
         # If Ghostscript subprocess failed, include hint
         msg = str(e)
@@ -230,40 +1039,199 @@ def compress_pdf():
             msg = f'Ghostscript failed: return code {e.returncode}. Check that gs is installed and accessible.'
         return msg, 500
 
+def compress_uploaded_pdf(in_path, out_path, level, cache_key, into=None):
+    """Compress with the engine this server runs and cache the result if an engine ran.
+
+    Stage seconds are added to into, by default this request's Server-Timing.
+    """
+    timings = {}
+    try:
+        # Without Ghostscript, embedded images are re-encoded on the batch pool
+        engine, outcome, share = compress_pdf_smaller(
+            in_path, out_path, level, min_share=app.config['PDF_MIN_COMPRESSIBLE_SHARE'],
+            gs_exec=app.config['GHOSTSCRIPT'], pool=ghostscript_pool(), timings=timings,
+            executor=None if app.config['GHOSTSCRIPT'] else batch_executor(),
+            shards=app.config['GS_SHARDS'], shard_pages=app.config['GS_SHARD_PAGES'], shard_slots=shard_slots
+        )
+    except ghostscript.GhostscriptError as e:
+        GHOSTSCRIPT_RUNS.inc('unknown' if e.returncode is None else e.returncode)
+        raise
+    finally:
+        if 'ghostscript' in timings:
+            GHOSTSCRIPT_SECONDS.observe(value=timings['ghostscript'])
+        add_timings(timings, into)
+    # The pre-scan is cheap, so only results an engine worked for are kept
+    if engine is not None:
+        pdf_cache.put(cache_key, out_path)
+    return engine, outcome, share
+
+def compress_pdf_streamed(file, level):
+    """Compress with a gs process of its own and stream its stdout into the response."""
+    # Spooled uploads are read in place; in-memory ones reach gs through a memfd or stdin
+    spooled = getattr(file.stream, 'name', None)
+    if isinstance(spooled, str) and os.path.isfile(spooled):
+        file.stream.flush()
+        source = spooled
+    else:
+        file.stream.seek(0)
+        source = file.stream
+
+    # gs keeps working while the response streams, so the slot is held until it has been sent
+    release_slot = acquire_route_slot()
+    try:
+        # The response streams while gs is still working, so only its start can be timed here;
+        # the whole run is observed in GHOSTSCRIPT_SECONDS once the stream is closed
+        with timed('ghostscript-start'):
+            stream = ghostscript.GhostscriptStream(app.config['GHOSTSCRIPT'], source, level)
+    except ghostscript.GhostscriptError as e:
+        release_slot()
+        GHOSTSCRIPT_RUNS.inc('unknown' if e.returncode is None else e.returncode)
+        return str(e), 500
+    except BaseException:
+        release_slot()
+        raise
+    PDF_COMPRESSIONS.inc('ghostscript')
+
+    def finished():
+        try:
+            stream.close()
+        finally:
+            release_slot()
+        if stream.elapsed is not None:
+            GHOSTSCRIPT_SECONDS.observe(value=stream.elapsed)
+        GHOSTSCRIPT_RUNS.inc('unknown' if stream.returncode is None else stream.returncode)
+
+    # The request (and its spooled upload) stays open until gs has finished
+    response = Response(
+        stream_with_context(stream),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': 'attachment; filename=compressed.pdf'}
+    )
+    response.call_on_close(finished)
+    return response
+
 @app.route('/merge-pdf', methods=['POST', 'OPTIONS'])
 def merge_pdf():
     if request.method == 'OPTIONS':
         return '', 200
 
-    if 'files[]' not in request.files:
-        return jsonify({'error': 'No files uploaded'}), 400
-    
-    files = request.files.getlist('files[]')
-    if not files or files[0].filename == '':
-        return jsonify({'error': 'No files selected'}), 400
-    
+    with timed('upload'):
+        request.files
+    files = merge_uploads(request.files.getlist('files[]'))
+
+    # Inputs are merged from files on disk and the result is written to disk too, so
+    # memory use stays bounded no matter how many or how large the uploads are
+    td = tempfile.mkdtemp(dir=app.config['UPLOAD_FOLDER'])
     try:
-        merger = PdfMerger()
-        
-        for file in files:
-            if not allowed_pdf_file(file.filename):
-                return f'Invalid file type: {file.filename}', 400
-            merger.append(file)
-        
-        output = io.BytesIO()
-        merger.write(output)
-        output.seek(0)
-        merger.close()
-        
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name='merged.pdf',
-            mimetype='application/pdf'
-        )
-    
+        with timed('save'):
+            input_paths = [upload_path(file, td, f'in-{index}.pdf') for index, file in enumerate(files)]
+        merge = PdfMerge(input_paths, os.path.join(td, 'merged.pdf'), g.timings)
+        result = merge.cached() or merge.run(slot=route_slot)
+        with timed('send'):
+            response = send_result(result, td)
     except Exception as e:
+        shutil.rmtree(td, ignore_errors=True)
+        if isinstance(e, AdmissionError):
+            raise
         return str(e), 500
+    return response
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def create_job(kind):
+    if kind not in ('convert-image', 'compress-pdf', 'merge-pdf'):
+        return jsonify({'error': f'Unknown job kind: {kind}'}), 404
+
+    upload_field = 'files[]' if kind == 'merge-pdf' else 'file'
+    if upload_field not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    files = request.files.getlist(upload_field)
+    if not files or files[0].filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    allowed = allowed_image_file if kind == 'convert-image' else allowed_pdf_file
+    for file in files:
+        if not allowed(file.filename):
+            return jsonify({'error': 'Unsupported file type'}), 415
+
+    if kind == 'convert-image':
+        target = (request.form.get('format') or '').lower()
+        if target not in FORMAT_MAP:
+            return jsonify({'error': 'Unsupported target format'}), 400
+        profile = request.form.get('profile') or app.config['IMAGE_PROFILE']
+        if profile not in PROFILES:
+            return jsonify({'error': f'Unknown profile: {profile}'}), 400
+        # Refuse oversized images now rather than failing inside the pool
+        admit_image(files[0].stream)
+
+    directory = job_manager.create_directory()
+    input_paths = []
+    for index, file in enumerate(files):
+        path = os.path.abspath(os.path.join(directory, f'in-{index}'))
+        save_upload(file, path)
+        input_paths.append(path)
+    result_path = os.path.abspath(os.path.join(directory, 'result'))
+
+    report_progress = False
+    if kind == 'convert-image':
+        pil_format = FORMAT_MAP[target]
+        base = os.path.splitext(files[0].filename)[0]
+        func = convert_image_file
+        args = (input_paths[0], result_path, pil_format, save_kwargs_for(pil_format, profile))
+        download_name = f'{base}.{target}'
+        mimetype = MIMETYPE_MAP[target]
+    elif kind == 'compress-pdf':
+        # Pool processes start their own gs per job; the persistent workers belong to the web process
+        func = functools.partial(compress_pdf_smaller, min_share=app.config['PDF_MIN_COMPRESSIBLE_SHARE'],
+                                 gs_exec=app.config['GHOSTSCRIPT'], shards=app.config['GS_SHARDS'],
+                                 shard_pages=app.config['GS_SHARD_PAGES'])
+        args = (input_paths[0], result_path, request.form.get('level', 'ebook'))
+        download_name = 'compressed.pdf'
+        mimetype = 'application/pdf'
+    else:
+        func = merge_pdf_files
+        args = (input_paths, result_path)
+        download_name = 'merged.pdf'
+        mimetype = 'application/pdf'
+        report_progress = True
+
+    try:
+        job = job_manager.submit(kind, directory, func, args, result_path, download_name, mimetype,
+                                 report_progress=report_progress)
+    except JobQueueFull:
+        return jsonify({'error': 'Too many pending jobs'}), 503, {'Retry-After': '5'}
+
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job.id}'
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    info = job.to_dict()
+    if info['status'] == 'failed':
+        return jsonify({'error': info['error']}), 500
+    if info['status'] != 'done':
+        return jsonify({'error': 'Job not finished', 'status': info['status']}), 409
+
+    # Streamed from disk rather than read into memory
+    return send_file(
+        job.result_path,
+        as_attachment=True,
+        download_name=job.download_name,
+        mimetype=job.mimetype
+    )
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,252 @@
+"""Async serving mode: `uvicorn asgi:app --host 0.0.0.0 --port 8000`.
+
+/convert-image, /compress-pdf and /merge-pdf are served on the event loop. Request
+bodies are parsed and responses sent without holding a thread, so a slow client
+costs a coroutine rather than a worker. The requests themselves are handled by the
+same ImageConversion, PdfCompression and PdfMerge as in the Flask app: cache lookups
+run on the thread pool, and conversions at most ASYNC_ROUTE_LIMITS[route] at a time
+per route, with Pillow and PyPDF2 work in the batch process pool.
+Every other route is served by the Flask app through WSGIMiddleware.
+"""
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+from admission import AdmissionError
+from app import (IN_FLIGHT, REQUEST_BYTES, REQUEST_SECONDS, REQUESTS, RESPONSE_BYTES, ImageConversion, PdfCompression,
+                 PdfMerge, RequestError, allowed_image_file, allowed_pdf_file, app as flask_app, batch_executor,
+                 body_limit, merge_uploads, server_timing_header, shutdown_pools, single_upload, stream_zip, timed)
+
+config = flask_app.config
+
+_route_slots = {}
+
+
+def route_slots(route):
+    """Return the semaphore bounding concurrent CPU work for route in this process."""
+    if route not in _route_slots:
+        _route_slots[route] = asyncio.Semaphore(config['ASYNC_ROUTE_LIMITS'][route])
+    return _route_slots[route]
+
+
+@contextlib.asynccontextmanager
+async def cpu_slot(route, timings):
+    """Wait for a free executor slot for route, or refuse with 503 after ASYNC_QUEUE_WAIT."""
+    slots = route_slots(route)
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(slots.acquire(), config['ASYNC_QUEUE_WAIT'])
+    except asyncio.TimeoutError:
+        raise AdmissionError('Server busy, try again later', 503, retry_after=5) from None
+    waited = time.perf_counter() - start
+    if waited > 0.001:
+        timings['queue'] = timings.get('queue', 0.0) + waited
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+async def convert(route, conversion, *args):
+    """Answer from the cache, else run the conversion in a route slot; both on the thread pool.
+
+    Waiting for an identical conversion in flight happens inside run(), so here it
+    holds a slot, unlike under Flask where only the conversion itself does.
+    """
+    result = await run_in_threadpool(conversion.cached, *args)
+    if result is None:
+        async with cpu_slot(route, conversion.timings):
+            result = await run_in_threadpool(conversion.run, batch_executor())
+    return result
+
+
+def result_response(result, directory=None):
+    """Turn a ConversionResult into a response; directory is removed once a file result is sent."""
+    disposition = {'Content-Disposition': f'attachment; filename={result.filename}'}
+    if result.entries is not None:
+        return StreamingResponse(stream_zip(result.entries), media_type=result.mimetype,
+                                 headers={**disposition, **result.headers})
+    if result.path is not None:
+        return FileResponse(result.path, media_type=result.mimetype, filename=result.filename, headers=result.headers,
+                            background=BackgroundTask(shutil.rmtree, directory, ignore_errors=True))
+    return Response(result.body, media_type=result.mimetype, headers={**disposition, **result.headers})
+
+
+def copy_upload(upload, path):
+    upload.file.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(upload.file, f)
+    return path
+
+
+def uploaded_files(form, field):
+    return [value for value in form.getlist(field) if not isinstance(value, str)]
+
+
+def limit_body(request, limit):
+    """Return request with its body capped at limit bytes, like MAX_CONTENT_LENGTH under Flask.
+
+    A Content-Length over the limit is refused before anything is read; a body that
+    turns out longer (chunked, or lying about its length) is refused as it is parsed.
+    """
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > limit:
+        raise RequestError('Upload too large', 413)
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise RequestError('Upload too large', 413)
+        return message
+
+    return Request(request.scope, receive)
+
+
+def instrumented(route, endpoint):
+    """Record the same request metrics and Server-Timing header the Flask hooks do."""
+    async def handler(request):
+        start = time.perf_counter()
+        status = 500
+        IN_FLIGHT.inc(route)
+        if request.headers.get('content-length', '').isdigit():
+            REQUEST_BYTES.inc(route, amount=int(request.headers['content-length']))
+        request.state.timings = {}
+        try:
+            response = await endpoint(limit_body(request, body_limit(route)))
+            status = response.status_code
+            if 'content-length' in response.headers:
+                RESPONSE_BYTES.inc(route, amount=int(response.headers['content-length']))
+            if request.state.timings and config['SERVER_TIMING']:
+                response.headers['Server-Timing'] = server_timing_header(
+                    request.state.timings, time.perf_counter() - start
+                )
+            return response
+        except (AdmissionError, RequestError) as e:
+            status = e.status
+            raise
+        finally:
+            REQUEST_SECONDS.observe(route, value=time.perf_counter() - start)
+            REQUESTS.inc(route, request.method, status)
+            IN_FLIGHT.dec(route)
+    return handler
+
+
+async def convert_image(request):
+    timings = request.state.timings
+    with timed('upload', timings):
+        form = await request.form()
+    try:
+        file = single_upload(uploaded_files(form, 'file'), allowed_image_file)
+        conversion = ImageConversion(file.filename, form, timings)
+        data = await file.read()
+    finally:
+        await form.close()
+
+    try:
+        return result_response(await convert('/convert-image', conversion, data))
+    except (AdmissionError, RequestError):
+        raise
+    except Exception as e:
+        return PlainTextResponse(str(e), 500)
+
+
+async def compress_pdf(request):
+    timings = request.state.timings
+    with timed('upload', timings):
+        form = await request.form()
+    try:
+        file = single_upload(uploaded_files(form, 'file'), allowed_pdf_file)
+        level = form.get('level') or 'ebook'
+        # Ghostscript workers may only touch files under the upload folder
+        td = tempfile.mkdtemp(dir=config['UPLOAD_FOLDER'])
+        try:
+            with timed('save', timings):
+                in_path = await run_in_threadpool(copy_upload, file, os.path.abspath(os.path.join(td, 'in.pdf')))
+        except Exception:
+            shutil.rmtree(td, ignore_errors=True)
+            raise
+    finally:
+        await form.close()
+
+    try:
+        compression = PdfCompression(in_path, os.path.abspath(os.path.join(td, 'out.pdf')), level, timings)
+        return result_response(await convert('/compress-pdf', compression), td)
+    except Exception as e:
+        shutil.rmtree(td, ignore_errors=True)
+        if isinstance(e, (AdmissionError, RequestError)):
+            raise
+        return PlainTextResponse(str(e), 500)
+
+
+async def merge_pdf(request):
+    timings = request.state.timings
+    with timed('upload', timings):
+        form = await request.form()
+    try:
+        files = merge_uploads(uploaded_files(form, 'files[]'))
+        td = tempfile.mkdtemp(dir=config['UPLOAD_FOLDER'])
+        try:
+            with timed('save', timings):
+                input_paths = [
+                    await run_in_threadpool(copy_upload, file, os.path.join(td, f'in-{index}.pdf'))
+                    for index, file in enumerate(files)
+                ]
+        except Exception:
+            shutil.rmtree(td, ignore_errors=True)
+            raise
+    finally:
+        await form.close()
+
+    try:
+        merge = PdfMerge(input_paths, os.path.join(td, 'merged.pdf'), timings)
+        return result_response(await convert('/merge-pdf', merge), td)
+    except Exception as e:
+        shutil.rmtree(td, ignore_errors=True)
+        if isinstance(e, (AdmissionError, RequestError)):
+            raise
+        return PlainTextResponse(str(e), 500)
+
+
+async def handle_admission_error(request, e):
+    headers = {'Retry-After': str(e.retry_after)} if e.retry_after is not None else None
+    return JSONResponse({'error': e.message}, status_code=e.status, headers=headers)
+
+
+async def handle_request_error(request, e):
+    return JSONResponse({'error': e.message}, status_code=e.status)
+
+
+app = Starlette(
+    routes=[
+        Route('/convert-image', instrumented('/convert-image', convert_image), methods=['POST']),
+        Route('/compress-pdf', instrumented('/compress-pdf', compress_pdf), methods=['POST']),
+        Route('/merge-pdf', instrumented('/merge-pdf', merge_pdf), methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={AdmissionError: handle_admission_error, RequestError: handle_request_error},
+    # Process pool workers would otherwise keep a stopping server process alive
+    on_shutdown=[shutdown_pools],
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:app', host='0.0.0.0', port=int(os.environ.get('PORT', 8000)))
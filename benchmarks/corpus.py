@@ -0,0 +1,96 @@
+"""Deterministic synthetic inputs shared by the benchmarks."""
+from PIL import Image, ImageDraw, ImageFilter
+import io
+
+
+def photo_image(size, alpha=False):
+    """A photo-like image: smooth gradients plus fine noise, optionally with a soft alpha vignette."""
+    width, height = size
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40)
+    image = Image.merge('RGB', (
+        gradient,
+        gradient.transpose(Image.FLIP_LEFT_RIGHT),
+        Image.blend(gradient.transpose(Image.ROTATE_90).resize(size), noise, 0.5),
+    ))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    if alpha:
+        mask = Image.radial_gradient('L').resize(size).point(lambda v: 255 - v)
+        image.putalpha(mask)
+    return image
+
+
+def graphic_image(size, alpha=False):
+    """A flat graphic: a few solid shapes and text on a plain background."""
+    mode = 'RGBA' if alpha else 'RGB'
+    background = (0, 0, 0, 0) if alpha else (255, 255, 255)
+    image = Image.new(mode, size, background)
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    step = max(8, width // 8)
+    for i, x in enumerate(range(0, width, step)):
+        colour = ((i * 53) % 256, (i * 97) % 256, (i * 151) % 256, 255)
+        draw.rectangle([x, height // 4, x + step // 2, 3 * height // 4], fill=colour[:len(mode)])
+    draw.ellipse([width // 3, height // 3, 2 * width // 3, 2 * height // 3], fill=(29, 185, 84, 255)[:len(mode)])
+    draw.text((10, 10), 'Spotconvert', fill=(0, 0, 0, 255)[:len(mode)])
+    return image
+
+
+def encode(image, pil_format, **kwargs):
+    buf = io.BytesIO()
+    image.save(buf, format=pil_format, **kwargs)
+    return buf.getvalue()
+
+
+# The largest PNG (about 11MB with alpha) stays under /convert-image's 16MB body limit
+# and MAX_IMAGE_PIXELS, so every case is converted rather than refused with 413
+IMAGE_SIZES = (64, 512, 2048, 4096)
+PDF_PAGE_COUNTS = (1, 10, 100, 1000)
+
+
+def image_corpus(sizes=IMAGE_SIZES, pil_format='PNG'):
+    """Yield (name, bytes) for photo-like images at each width, with and without alpha."""
+    for width in sizes:
+        size = (width, max(1, width * 3 // 4))
+        for alpha in (False, True):
+            fmt = pil_format
+            if alpha and fmt == 'JPEG':
+                fmt = 'PNG'
+            name = f'photo-{width}{"-alpha" if alpha else ""}.{fmt.lower()}'
+            # Fast zlib level keeps corpus generation quick; the benchmark measures decoding it
+            kwargs = {'compress_level': 1} if fmt == 'PNG' else {}
+            yield name, encode(photo_image(size, alpha=alpha), fmt, **kwargs)
+
+
+def pdf_document(pages, images=True):
+    """A letter-size PDF with a paragraph of text and, optionally, a raster image on every page."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    # A handful of distinct images so the file is not trivially deduplicated
+    pictures = []
+    if images:
+        for i in range(8):
+            picture = photo_image((600 + i * 16, 450))
+            pictures.append(ImageReader(io.BytesIO(encode(picture, 'JPEG', quality=90))))
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=letter)
+    for page in range(pages):
+        y = 750
+        c.drawString(72, y, f'Page {page + 1} of {pages}')
+        for line in range(20):
+            y -= 14
+            c.drawString(72, y, f'Line {line + 1}: the quick brown fox jumps over the lazy dog. ' * 2)
+        if pictures:
+            c.drawImage(pictures[page % len(pictures)], 72, 72, width=468, height=351)
+        c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def pdf_corpus(page_counts=PDF_PAGE_COUNTS):
+    """Yield (name, bytes) for text-and-image PDFs of each page count."""
+    for pages in page_counts:
+        yield f'doc-{pages}p.pdf', pdf_document(pages)
@@ -0,0 +1,299 @@
+"""Load generator: saturation curve of a locally started server under a request mix.
+
+Starts the app in its own process (Gunicorn, the async server or the threaded
+development server), then replays a weighted mix of /convert-image, /compress-pdf
+and /merge-pdf requests from a fixed number of closed-loop clients. The number of
+clients is raised step by step. Each step reports throughput, error and shed rates
+and latency percentiles, so the curve shows where throughput stops growing and
+latency or errors take off.
+
+Every upload gets a few unique trailing bytes, which image decoders and PDF readers
+ignore, so the result caches cannot answer repeats.
+
+Usage:
+  python -m benchmarks.loadgen [--server gunicorn|asgi|dev] [--workers 4] [--threads 1]
+                               [--url http://host:port] [--concurrency 1,2,4,8,16,32]
+                               [--duration 10] [--mix image=8,compress=1,merge=1]
+                               [--json curve.json] [--compare old.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from benchmarks import corpus
+from benchmarks.run import encode_multipart, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = 'image=8,compress=1,merge=1'
+
+
+# --- fixtures ------------------------------------------------------------------------
+
+def build_fixtures(image_width):
+    """Return {kind: [(path, fields, files)]} for each request kind in the mix."""
+    size = (image_width, image_width * 3 // 4)
+    photo = corpus.encode(corpus.photo_image(size), 'JPEG', quality=90)
+    graphic = corpus.encode(corpus.graphic_image(size, alpha=True), 'PNG')
+    document = corpus.pdf_document(10)
+    part = corpus.pdf_document(2)
+    return {
+        'image': [
+            ('/convert-image', {'format': 'webp'}, [('file', 'photo.jpg', photo)]),
+            ('/convert-image', {'format': 'jpg'}, [('file', 'graphic.png', graphic)]),
+        ],
+        'compress': [
+            ('/compress-pdf', {'level': 'ebook'}, [('file', 'doc-10p.pdf', document)]),
+        ],
+        'merge': [
+            ('/merge-pdf', {}, [('files[]', f'part-{i}.pdf', part) for i in range(4)]),
+        ],
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+# --- server --------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(kind, port, workers, threads):
+    if kind == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app',
+                '--bind', f'127.0.0.1:{port}', '--workers', str(workers), '--threads', str(threads)]
+    if kind == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--no-access-log']
+    # Flask's threaded development server, without the debugger or reloader
+    return [sys.executable, '-c', f'from app import app; app.run(host="127.0.0.1", port={port}, threaded=True)']
+
+
+def wait_until_ready(host, port, process=None, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        conn = http.client.HTTPConnection(host, port, timeout=1)
+        try:
+            conn.request('GET', '/metrics')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+        finally:
+            conn.close()
+    raise RuntimeError(f'server on port {port} did not answer within {timeout}s')
+
+
+def stop_server(process, timeout=30):
+    """Stop the server and every process it started, forcibly if it does not exit in time."""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
+
+# --- load ----------------------------------------------------------------------------
+
+class Step:
+    """Outcomes of every request sent at one concurrency level."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []  # (kind, status, seconds); status 0 for a transport error
+
+    def record(self, kind, status, seconds):
+        with self.lock:
+            self.samples.append((kind, status, seconds))
+
+    def summary(self, concurrency, elapsed):
+        def stats(samples):
+            latencies = [seconds for _, status, seconds in samples if status == 200]
+            result = {
+                'requests': len(samples),
+                'throughput_rps': len(latencies) / elapsed,
+                'error_rate': sum(1 for _, status, _ in samples if status not in (200, 503)) / max(1, len(samples)),
+                'shed_rate': sum(1 for _, status, _ in samples if status == 503) / max(1, len(samples)),
+            }
+            for q in (50, 95, 99):
+                result[f'p{q}_ms'] = percentile(latencies, q) * 1000 if latencies else None
+            return result
+
+        result = {'concurrency': concurrency, **stats(self.samples)}
+        result['routes'] = {
+            kind: stats([s for s in self.samples if s[0] == kind])
+            for kind in sorted({s[0] for s in self.samples})
+        }
+        return result
+
+
+def send(host, port, path, body, content_type):
+    conn = http.client.HTTPConnection(host, port, timeout=600)
+    try:
+        conn.request('POST', path, body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except OSError:
+        return 0
+    finally:
+        conn.close()
+
+
+def client(host, port, fixtures, kinds, weights, seed, stop, step):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        kind = rng.choices(kinds, weights)[0]
+        path, fields, files = rng.choice(fixtures[kind])
+        files = [(field, name, data + rng.randbytes(16)) for field, name, data in files]
+        body, content_type = encode_multipart(fields, files)
+        start = time.perf_counter()
+        status = send(host, port, path, body, content_type)
+        # Requests still running when the step ends are counted if they finish
+        step.record(kind, status, time.perf_counter() - start)
+
+
+def run_step(host, port, fixtures, mix, concurrency, duration, seed):
+    kinds = [kind for kind in mix if mix[kind] > 0]
+    weights = [mix[kind] for kind in kinds]
+    step = Step()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=client, args=(host, port, fixtures, kinds, weights, seed + i, stop, step), daemon=True)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return step.summary(concurrency, time.perf_counter() - start)
+
+
+def knee(curve, gain=0.05, max_error_rate=0.01):
+    """The last step before throughput stopped growing by gain or errors passed max_error_rate."""
+    best = None
+    for result in curve:
+        if result['error_rate'] + result['shed_rate'] > max_error_rate:
+            break
+        if best is not None and result['throughput_rps'] < best['throughput_rps'] * (1 + gain):
+            break
+        best = result
+    return best
+
+
+def format_ms(value):
+    return f'{value:>9.1f}' if value is not None else f'{"-":>9}'
+
+
+def print_header(compare=False):
+    header = f'{"clients":>7} {"reqs":>6} {"rps":>8} {"errors":>7} {"shed":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}'
+    print(header + (f' {"rps before":>10} {"p95 before":>10}' if compare else ''))
+
+
+def print_row(result, before=None):
+    line = (f'{result["concurrency"]:>7} {result["requests"]:>6} {result["throughput_rps"]:>8.2f} '
+            f'{result["error_rate"]:>7.1%} {result["shed_rate"]:>7.1%} {format_ms(result["p50_ms"])} '
+            f'{format_ms(result["p95_ms"])} {format_ms(result["p99_ms"])}')
+    if before is not None:
+        line += f' {before["throughput_rps"]:>10.2f} {format_ms(before["p95_ms"]):>10}'
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=('gunicorn', 'asgi', 'dev'), default='gunicorn',
+                        help='how to start the app; ignored with --url')
+    parser.add_argument('--url', help='load an already running server instead of starting one')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='server worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='threads per Gunicorn worker (gthread when > 1)')
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32', help='comma-separated client counts, one step each')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per step')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='relative weights of image, compress and merge requests')
+    parser.add_argument('--image-width', type=int, default=1024, help='width of the uploaded images')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the request sequence')
+    parser.add_argument('--stop-error-rate', type=float, default=0.5,
+                        help='skip the remaining steps once this fraction of requests fail or are shed')
+    parser.add_argument('--json', help='write the curve to this file')
+    parser.add_argument('--compare', help='show a curve saved with --json alongside this one')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    fixtures = build_fixtures(args.image_width)
+    unknown = set(mix) - set(fixtures)
+    if unknown:
+        parser.error(f'unknown request kinds in --mix: {", ".join(sorted(unknown))}')
+
+    process = None
+    if args.url:
+        parsed = urllib.parse.urlsplit(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+        wait_until_ready(host, port)
+    else:
+        host, port = '127.0.0.1', free_port()
+        process = subprocess.Popen(server_command(args.server, port, args.workers, args.threads), cwd=ROOT,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        wait_until_ready(host, port, process)
+
+    curve = []
+    try:
+        print(f'{args.server if process else args.url}: {args.workers} workers, mix {args.mix}, '
+              f'{args.duration:g}s per step')
+        print_header()
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            result = run_step(host, port, fixtures, mix, concurrency, args.duration, args.seed)
+            curve.append(result)
+            print_row(result)
+            if result['error_rate'] + result['shed_rate'] >= args.stop_error_rate:
+                print(f'stopping: {result["error_rate"] + result["shed_rate"]:.0%} of requests failed or were shed')
+                break
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = {result['concurrency']: result for result in json.load(f)['curve']}
+        print(f'\ncompared with {args.compare}:')
+        print_header(compare=True)
+        for result in curve:
+            print_row(result, before.get(result['concurrency']))
+    best = knee(curve)
+    if best is not None:
+        print(f'\nsaturation: {best["throughput_rps"]:.2f} requests/s at {best["concurrency"]} clients '
+              f'(p95 {format_ms(best["p95_ms"]).strip()} ms)')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'server': args.server if process else args.url, 'workers': args.workers,
+                       'threads': args.threads, 'mix': mix, 'duration': args.duration, 'curve': curve},
+                      f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
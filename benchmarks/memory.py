@@ -0,0 +1,110 @@
+"""Peak memory per megapixel of image conversion, for each source mode and target format.
+
+Each case runs in a fresh interpreter so earlier cases cannot mask its peak: the child
+records its peak RSS after reading the encoded input, converts once, and reports how
+far the peak rose. Linux and macOS only.
+
+Usage: python -m benchmarks.memory [--size 4096] [--json results.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.corpus import encode, photo_image
+
+TARGETS = ('JPEG', 'PNG', 'WEBP')
+
+
+def source_images(size):
+    """Yield (name, image) for every source mode the converter handles differently."""
+    photo = photo_image(size, alpha=True)
+    yield 'RGB', photo.convert('RGB')
+    yield 'RGBA', photo
+    yield 'L', photo.convert('L')
+    yield 'LA', photo.convert('LA')
+    yield 'P', photo.convert('RGB').quantize(256)
+    yield 'P+transparency', photo.quantize(256)
+
+
+def _peak_rss():
+    # ru_maxrss survives exec on Linux, so it would report the parent's peak; VmHWM
+    # belongs to this process's address space alone
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def child(path, pil_format, width):
+    """Convert the image at path once and print the rise in peak RSS, in bytes."""
+    from imaging import convert_image_data, save_kwargs_for
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    save_kwargs = save_kwargs_for(pil_format)
+    before = _peak_rss()
+    convert_image_data(data, pil_format, save_kwargs, width=width)
+    print(_peak_rss() - before)
+
+
+def measure(path, pil_format, width=None):
+    cmd = [sys.executable, '-m', 'benchmarks.memory', '--child', path, pil_format, str(width or 0)]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return int(output.split()[-1])
+
+
+def run(size):
+    megapixels = size[0] * size[1] / 1_000_000
+    rows = []
+    with tempfile.TemporaryDirectory() as td:
+        for name, image in source_images(size):
+            path = os.path.join(td, 'source.png')
+            with open(path, 'wb') as f:
+                f.write(encode(image, 'PNG', compress_level=1))
+            for pil_format in TARGETS:
+                peak = measure(path, pil_format)
+                half = measure(path, pil_format, width=size[0] // 2)
+                rows.append({
+                    'source': name,
+                    'format': pil_format,
+                    'mb_per_mp': peak / megapixels / (1024 * 1024),
+                    'resized_mb_per_mp': half / megapixels / (1024 * 1024),
+                })
+    return rows
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--child':
+        path, pil_format, width = sys.argv[2:5]
+        child(path, pil_format, int(width) or None)
+        return 0
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=4096, help='image width in pixels (4:3 aspect)')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    size = (args.size, args.size * 3 // 4)
+    rows = run(size)
+    print(f'Peak RSS growth per megapixel, {size[0]}x{size[1]} source')
+    print('| source | format | MB/MP | MB/MP at half width |')
+    print('|---|---|---:|---:|')
+    for row in rows:
+        print(f'| {row["source"]} | {row["format"]} | {row["mb_per_mp"]:.2f} | {row["resized_mb_per_mp"]:.2f} |')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""Measure encode throughput and output size of each image encoder profile.
+
+Usage: python -m benchmarks.profiles [--size 2048] [--repeat 3]
+"""
+import argparse
+import time
+
+from imaging import PROFILES, convert_image_data, save_kwargs_for
+from benchmarks.corpus import encode, graphic_image, photo_image
+
+
+def run(size, repeat):
+    sources = {
+        'photo': encode(photo_image((size, size * 3 // 4)), 'PNG', compress_level=1),
+        'graphic+alpha': encode(graphic_image((size, size * 3 // 4), alpha=True), 'PNG', compress_level=1),
+    }
+    megapixels = size * (size * 3 // 4) / 1_000_000
+    rows = []
+    for source_name, data in sources.items():
+        for pil_format in ('JPEG', 'WEBP', 'PNG'):
+            for profile in PROFILES:
+                save_kwargs = save_kwargs_for(pil_format, profile)
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    output = convert_image_data(data, pil_format, save_kwargs)
+                    timings.append(time.perf_counter() - start)
+                best = min(timings)
+                rows.append((source_name, pil_format, profile, megapixels / best, len(output)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=2048, help='image width in pixels (4:3 aspect)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case; the fastest is reported')
+    args = parser.parse_args()
+
+    print('| source | format | profile | MP/s | output KB |')
+    print('|---|---|---|---:|---:|')
+    for source_name, pil_format, profile, throughput, output_size in run(args.size, args.repeat):
+        print(f'| {source_name} | {pil_format} | {profile} | {throughput:.1f} | {output_size / 1024:.0f} |')
+
+
+if __name__ == '__main__':
+    main()
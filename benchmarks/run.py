@@ -0,0 +1,290 @@
+"""Per-endpoint benchmark suite: throughput, latency percentiles and peak RSS.
+
+Drives /convert-image, /compress-pdf and /merge-pdf with synthetic corpora, either
+in-process through Flask's test client or over HTTP against a local server, and
+optionally compares the results against a stored baseline.
+
+Usage:
+  python -m benchmarks.run [--quick] [--transport inprocess|http|both]
+                           [--iterations 20] [--time-budget 10]
+                           [--json results.json] [--save-baseline benchmarks/baseline.json]
+                           [--baseline benchmarks/baseline.json] [--tolerance 0.25]
+
+Exits with status 1 when any case fails or regresses past the tolerance.
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+from benchmarks import corpus
+
+
+# --- measurement helpers -------------------------------------------------------------
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Peak rather than current (KB on Linux, bytes on macOS), but still bounds the true peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class RssSampler:
+    """Samples RSS on a background thread and records the peak seen inside the with-block."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+# --- transports ----------------------------------------------------------------------
+
+def encode_multipart(fields, files):
+    """Build a multipart/form-data body; files is a list of (field, filename, bytes)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for field, filename, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class InProcessTransport:
+    name = 'inprocess'
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def post(self, path, fields, files):
+        body, content_type = encode_multipart(fields, files)
+        response = self.client.post(path, data=body, content_type=content_type)
+        size = len(response.data)
+        response.close()
+        return response.status_code, size
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    name = 'http'
+
+    def __init__(self, app):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def post(self, path, fields, files):
+        body, content_type = encode_multipart(fields, files)
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=600)
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': content_type})
+            response = conn.getresponse()
+            size = len(response.read())
+            return response.status, size
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+# --- cases ---------------------------------------------------------------------------
+
+def build_cases(quick):
+    image_sizes = (64, 512, 2048) if quick else corpus.IMAGE_SIZES
+    page_counts = (1, 10, 100) if quick else corpus.PDF_PAGE_COUNTS
+
+    cases = []
+    for name, data in corpus.image_corpus(image_sizes):
+        for target in ('jpg', 'webp', 'png'):
+            cases.append((f'convert-image/{name}->{target}', '/convert-image',
+                          {'format': target}, [('file', name, data)]))
+
+    documents = dict(corpus.pdf_corpus(page_counts))
+    for name, data in documents.items():
+        cases.append((f'compress-pdf/{name}', '/compress-pdf',
+                      {'level': 'ebook'}, [('file', name, data)]))
+
+    small = documents['doc-10p.pdf']
+    merge_counts = (2, 10) if quick else (2, 10, 100)
+    for count in merge_counts:
+        files = [('files[]', f'part-{i}.pdf', small) for i in range(count)]
+        cases.append((f'merge-pdf/{count}x10p', '/merge-pdf', {}, files))
+    return cases
+
+
+def run_case(transport, path, fields, files, iterations, time_budget):
+    # One warm-up request, which also sizes the run to the time budget
+    start = time.perf_counter()
+    status, _ = transport.post(path, fields, files)
+    first = time.perf_counter() - start
+    if status != 200:
+        return {'error': f'HTTP {status}'}
+    iterations = max(3, min(iterations, int(time_budget / max(first, 1e-6))))
+
+    bytes_in = sum(len(data) for _, _, data in files)
+    latencies = []
+    with RssSampler() as rss:
+        run_start = time.perf_counter()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            status, bytes_out = transport.post(path, fields, files)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                return {'error': f'HTTP {status}'}
+        elapsed = time.perf_counter() - run_start
+
+    return {
+        'iterations': iterations,
+        'throughput_rps': iterations / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_rss_mb': rss.peak / (1024 * 1024),
+        'bytes_in': bytes_in,
+        'bytes_out': bytes_out
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of human-readable regressions of results against baseline."""
+    regressions = []
+    # Absolute slack keeps tiny, noisy cases from flapping
+    slack = {'p95_ms': 5.0, 'peak_rss_mb': 16.0}
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None or 'error' in result or 'error' in base:
+            continue
+        for metric, extra in slack.items():
+            limit = base[metric] * (1 + tolerance) + extra
+            if result[metric] > limit:
+                regressions.append(f'{key}: {metric} {result[metric]:.1f} > {limit:.1f} (baseline {base[metric]:.1f})')
+        floor = base['throughput_rps'] / (1 + tolerance)
+        if result['throughput_rps'] < floor and result['p95_ms'] > slack['p95_ms']:
+            regressions.append(f'{key}: throughput {result["throughput_rps"]:.2f}/s < {floor:.2f}/s')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='skip the 4k images, 1000-page PDFs and 100-file merge')
+    parser.add_argument('--transport', choices=('inprocess', 'http', 'both'), default='both')
+    parser.add_argument('--iterations', type=int, default=20, help='maximum timed requests per case')
+    parser.add_argument('--time-budget', type=float, default=10.0, help='approximate seconds per case')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--save-baseline', help='write results as the new baseline to this file')
+    parser.add_argument('--baseline', help='compare against this baseline and fail on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    import app as app_module
+    # Measure the real work, not the result cache
+    app_module.image_cache.clear()
+    app_module.image_cache.max_bytes = 0
+    app_module.pdf_cache.clear()
+    app_module.pdf_cache.max_bytes = 0
+
+    transports = []
+    if args.transport in ('inprocess', 'both'):
+        transports.append(InProcessTransport(app_module.app))
+    if args.transport in ('http', 'both'):
+        transports.append(HttpTransport(app_module.app))
+
+    cases = [case for case in build_cases(args.quick) if args.filter in case[0]]
+    results = {}
+    print(f'{"case":<58} {"rps":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"RSS MB":>8}')
+    for transport in transports:
+        for name, path, fields, files in cases:
+            key = f'{transport.name}:{name}'
+            result = run_case(transport, path, fields, files, args.iterations, args.time_budget)
+            results[key] = result
+            if 'error' in result:
+                print(f'{key:<58} {result["error"]}')
+            else:
+                print(f'{key:<58} {result["throughput_rps"]:>8.2f} {result["p50_ms"]:>9.1f} '
+                      f'{result["p95_ms"]:>9.1f} {result["p99_ms"]:>9.1f} {result["peak_rss_mb"]:>8.1f}')
+        transport.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    failed = [key for key, result in results.items() if 'error' in result]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    for key in failed:
+        print(f'FAILED: {key}: {results[key]["error"]}')
+    for regression in regressions:
+        print(f'REGRESSION: {regression}')
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+from collections import OrderedDict
+import contextlib
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: keys are only coalesced within a process
+    fcntl = None
+
+
+def make_key(data, *parts):
+    """Build a content-addressed cache key from input bytes plus the settings that shape the output."""
+    digest = hashlib.sha256(data)
+    for part in parts:
+        if isinstance(part, dict):
+            part = sorted(part.items())
+        digest.update(b'\0')
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    """SHA-256 hex digest of the file at path, read in chunks."""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _link_or_copy(src, dst):
+    # Entries live on the same filesystem as the work files, so a hard link avoids the copy
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """Thread-safe in-memory LRU cache of encoded results, bounded by total byte size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = len(value)
+        # Results larger than the whole budget would just flush everything else
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self._entries[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class DiskCache:
+    """LRU cache of result files in a directory, shared by every process that uses it.
+
+    Entries are written to a temp file next to their final name and renamed into place,
+    so no process ever sees a partial entry. A hit refreshes the entry's mtime, and a put
+    that takes the directory over max_bytes removes the entries with the oldest mtimes.
+    Hits are hard-linked to the caller's path, so an eviction cannot pull a file out from
+    under a response that is still being sent. Hit, miss and eviction counts are per process.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, path):
+        """Place the entry for key at path and return True, or return False if there is none."""
+        entry = self._path(key)
+        try:
+            _link_or_copy(entry, path)
+            os.utime(entry)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, path):
+        """Store a copy of the file at path under key."""
+        if os.path.getsize(path) > self.max_bytes:
+            return
+        entry = self._path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(entry), f'.tmp-{uuid.uuid4().hex}')
+        try:
+            _link_or_copy(path, tmp)
+            os.replace(tmp, entry)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+        self._evict()
+
+    def _entries(self):
+        """Return [(mtime, size, path)] for every complete entry."""
+        entries = []
+        with contextlib.suppress(FileNotFoundError):
+            for bucket in os.scandir(self.directory):
+                if not bucket.is_dir():
+                    continue
+                for item in os.scandir(bucket.path):
+                    if item.name.startswith('.'):
+                        continue
+                    try:
+                        stat = item.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            # Another process may be evicting the same entry
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+                with self._lock:
+                    self.evictions += 1
+            total -= size
+
+    def clear(self):
+        for _, _, path in self._entries():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent computations of the same key.
+
+    do() runs func once for all threads of this process that ask for a key while it is
+    running; the others wait and receive its result or exception. lock() serialises a key
+    across threads and, through an flock on a file in directory, across processes. It
+    suits results shared through a DiskCache: whoever gets the lock second re-checks the
+    cache and finds the first one's result there.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.coalesced = 0
+        self._flights = {}
+        self._key_locks = {}  # key: [lock, holders and waiters]
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def do(self, key, func, *args, **kwargs):
+        """Return (func's result, whether it came from another caller's run)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = func(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            # Later callers start a fresh run; they should find the result in a cache
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Hold key's lock within this process and, with a directory, across processes."""
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if self.directory is None or fcntl is None:
+                    yield
+                else:
+                    with self._file_lock(os.path.join(self.directory, f'{key}.lock')):
+                        yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _file_lock(path):
+        while True:
+            f = open(path, 'ab')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # The previous holder unlinks the file on release; a lock on an unlinked file
+            # excludes nobody, so retry until the locked file is the one at path
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        try:
+            yield
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            f.close()
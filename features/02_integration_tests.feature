@@ -27,4 +27,46 @@ Feature: Integration Tests
     Given the application is running
     When I send an OPTIONS request to "/convert-image"
     Then the response should include CORS headers
-    And the response status code should be 200
\ No newline at end of file
+    And the response status code should be 200
+
+  @integration @api @error-handling
+  Scenario: Files that are not really images are rejected before decoding
+    Given I have a text file named "photo.png"
+    When I try to convert it to "jpg"
+    Then the response status code should be 415
+    And the response should contain "Unsupported file type"
+
+  @integration @api @error-handling
+  Scenario: Images over the pixel limit are rejected
+    Given the image pixel limit is 1000
+    And I have a PNG image
+    When I convert it to "jpg"
+    Then the response status code should be 413
+    And the response should contain "exceeds the pixel limit"
+
+  @integration @api @error-handling
+  Scenario: Conversions are shed when the decode budget is exhausted
+    Given the image decode budget is exhausted
+    And I have a PNG image
+    And the image cache is empty
+    When I convert it to "webp"
+    Then the response status code should be 503
+    And the response should have a "Retry-After" header
+
+  @integration @api @error-handling
+  Scenario: Requests are shed when a route's queue is full
+    Given every "/compress-pdf" slot is busy and its queue is full
+    And I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response status code should be 503
+    And the response should have a "Retry-After" header
+    When I scrape the metrics
+    Then the metrics should include "spotconvert_shed_total{route="/compress-pdf"}"
+    And the metrics should include "spotconvert_queue_depth{route="/compress-pdf"}"
+
+  @integration @api @error-handling
+  Scenario: Requests rejected before conversion do not wait for a route slot
+    Given every "/convert-image" slot is busy and its queue is full
+    And I have a text file
+    When I try to convert it to "png"
+    Then the response status code should be 415
@@ -36,4 +36,32 @@ Feature: Functional Tests
     Given I have multiple images in different formats
     When I convert all images to "webp"
     Then all conversions should be successful
-    And all output files should be in WebP format
\ No newline at end of file
+    And all output files should be in WebP format
+
+  @functional @batch-processing
+  Scenario: Batch image conversion in a single request
+    Given I have multiple images in different formats
+    When I convert all images to "webp" in one request
+    Then the conversion should be successful
+    And the response should be a ZIP archive of 3 WebP images
+
+  @functional @batch-processing
+  Scenario: Batch image conversion of an uploaded ZIP archive
+    Given I have multiple images in different formats
+    When I upload them as a ZIP archive for conversion to "png"
+    Then the conversion should be successful
+    And the response should be a ZIP archive of 3 PNG images
+
+  @functional @batch-processing
+  Scenario: Archive member names cannot point outside the archive
+    Given I have a PNG image
+    When I upload a ZIP archive of the image as "../../evil.png, /abs.png, images/photo.png" for conversion to "webp"
+    Then the conversion should be successful
+    And the archive should hold "evil.webp, abs.webp, images_photo.webp" in any order
+
+  @functional @batch-processing
+  Scenario: An abandoned batch conversion returns its decode budget
+    Given I have 6 large PNG images
+    And the image cache is empty
+    When I convert all images to "webp" in one request and stop reading after the first chunk
+    Then the image decode budget should be released
@@ -0,0 +1,60 @@
+Feature: Async serving mode
+  The ASGI app serves the conversion routes on the event loop and hands CPU work to executors
+
+  Scenario: Convert an image through the async server
+    Given I have a PNG image
+    When I request a "webp" conversion from the async server
+    Then the response status code should be 200
+    And the response content-type should be "image/webp"
+    And the response filename should end with ".webp"
+
+  Scenario: Merge PDFs through the async server
+    Given I have two generated PDF files
+    When I merge them through the async server
+    Then the response status code should be 200
+    And the response content-type should be "application/pdf"
+
+  Scenario: Other routes are served by the Flask app
+    Given the application is running
+    When I request "/cache-stats" from the async server
+    Then the response status code should be 200
+
+  Scenario: Conversions beyond the route limit are refused
+    Given I have a PNG image
+    And the image cache is empty
+    And the async server allows 0 concurrent "/convert-image" jobs
+    When I request a "webp" conversion from the async server
+    Then the response status code should be 503
+    And the response should have a "Retry-After" header
+
+  Scenario: The async server picks the smallest format
+    Given I have a PNG image
+    When I request a "auto" conversion from the async server
+    Then the response status code should be 200
+    And the response should have a "X-Image-Format" header
+
+  Scenario: The async server reports a per-stage Server-Timing header
+    Given I have a PNG image
+    And the image cache is empty
+    When I request a "webp" conversion from the async server
+    Then the Server-Timing header should list "upload, admit, cache, decode, encode, total"
+
+  Scenario: Identical conversions through the async server run once
+    Given I have a PNG image
+    And the image cache is empty
+    When 3 clients request a "webp" conversion from the async server at the same time
+    Then the conversion should have run once
+    And every client should receive the same file
+    And the other clients should report X-Cache "COALESCED"
+
+  Scenario: The async server refuses uploads over the route limit
+    Given image uploads are limited to 100 bytes
+    And I have a PNG image
+    When I request a "webp" conversion from the async server
+    Then the response status code should be 413
+
+  Scenario: The async server refuses bodies that outgrow the limit while they are read
+    Given image uploads are limited to 100 bytes
+    And I have a PNG image
+    When I stream a "webp" conversion to the async server without a Content-Length
+    Then the response status code should be 413
@@ -0,0 +1,33 @@
+Feature: Request coalescing
+  Identical conversions that arrive together run once and share the result
+
+  Scenario: Identical image conversions arriving together run once
+    Given I have a PNG image
+    And the image cache is empty
+    When 4 clients convert it to "webp" at the same time
+    Then the conversion should have run once
+    And every client should receive the same file
+    And the other clients should report X-Cache "COALESCED"
+
+  Scenario: Identical auto-format conversions arriving together run their trials once
+    Given I have a PNG image
+    And the image cache is empty
+    When 4 clients convert it to "auto" at the same time
+    Then the conversion should have run once
+    And every client should receive the same file
+    And the other clients should report X-Cache "COALESCED"
+
+  Scenario: Identical PDF compressions arriving together run once
+    Given Ghostscript is not installed
+    And the PDF cache is empty
+    And I have a PDF with a high-resolution photo
+    When 3 clients compress it with level "screen" at the same time
+    Then the conversion should have run once
+    And every client should receive the same file
+    And the other clients should report X-Cache "COALESCED"
+
+  Scenario: PDF conversions are coalesced across worker processes
+    When this process holds the PDF lock for "report"
+    Then another process should wait for the PDF lock for "report"
+    When this process releases the PDF lock
+    Then another process should get the PDF lock for "report"
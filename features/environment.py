@@ -2,70 +2,139 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
-from flask import url_for
+from werkzeug.serving import make_server
+import http.client
+import os
+import shutil
+import tempfile
 import threading
 import time
-from app import app
+from app import app, pdf_cache
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# run_tests.py gives each shard its own port so parallel runs do not collide
+PORT = int(os.environ.get('SPOTCONVERT_TEST_PORT', 5000))
+WINDOW_SIZE = (1280, 800)
+
+
+class BrowserPool:
+    """Headless Chrome sessions reused across scenarios instead of one launch per scenario."""
+
+    def __init__(self):
+        self._driver_path = None
+        self._idle = []
+
+    def driver_path(self):
+        # ChromeDriverManager checks versions over the network, so resolve it once per run
+        if self._driver_path is None:
+            self._driver_path = ChromeDriverManager().install()
+            logger.info(f"ChromeDriver installed at: {self._driver_path}")
+        return self._driver_path
+
+    def _launch(self):
+        options = Options()
+        options.add_argument('--headless')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        driver = webdriver.Chrome(service=Service(self.driver_path()), options=options)
+        driver.implicitly_wait(10)
+        return driver
+
+    def acquire(self):
+        driver = self._idle.pop() if self._idle else self._launch()
+        driver.set_window_size(*WINDOW_SIZE)
+        return driver
+
+    def release(self, driver):
+        """Reset the browser's state and keep it for the next scenario, or quit it if that fails."""
+        try:
+            driver.delete_all_cookies()
+            driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+            driver.get('about:blank')
+        except Exception as e:
+            logger.warning(f"Discarding browser that could not be reset: {str(e)}")
+            self._quit(driver)
+        else:
+            self._idle.append(driver)
+
+    def close(self):
+        while self._idle:
+            self._quit(self._idle.pop())
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Error closing WebDriver: {str(e)}")
+
+
+def wait_until_ready(port, timeout=10):
+    """Poll the server until it answers, instead of sleeping for a fixed time."""
+    deadline = time.monotonic() + timeout
+    last = 'no answer'
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+        try:
+            conn.request('GET', '/')
+            status = conn.getresponse().status
+            if status == 200:
+                return
+            last = f'status {status}'
+        except OSError as e:
+            last = str(e)
+        finally:
+            conn.close()
+        time.sleep(0.05)
+    raise RuntimeError(f'server on port {port} not ready within {timeout}s: {last}')
+
+
 def before_all(context):
     logger.info("Setting up test environment")
     app.config['TESTING'] = True
     context.client = app.test_client()
-    
+    context.browsers = BrowserPool()
+    # Cached PDFs from earlier runs, or from parallel shards, would turn misses into hits
+    pdf_cache.directory = tempfile.mkdtemp(prefix='pdf-cache-')
+
     # Start Flask server
-    context.server = threading.Thread(target=lambda: app.run(port=5000))
-    context.server.daemon = True
-    context.server.start()
-    time.sleep(2)  # Wait for server to start
+    context.server = make_server('127.0.0.1', PORT, app, threaded=True)
+    context.server_thread = threading.Thread(target=context.server.serve_forever, daemon=True)
+    context.server_thread.start()
+    wait_until_ready(PORT)
+    context.base_url = f'http://localhost:{PORT}'
     # Push app context so url_for and other Flask helpers work in steps
     context.app_context = app.app_context()
     context.app_context.push()
-    logger.info("Flask server started")
+    logger.info(f"Flask server started on port {PORT}")
 
 def before_scenario(context, scenario):
     logger.info(f"Starting scenario: {scenario.name}")
-    # Initialize WebDriver for UI and Acceptance tests (both need a browser)
+    # UI and Acceptance tests both need a browser
     tags = [t.lower() for t in (list(scenario.feature.tags) + list(scenario.tags))]
     if 'ui' in tags or 'acceptance' in tags:
-        logger.info("Setting up WebDriver for UI test")
         try:
-            options = Options()
-            options.add_argument('--headless')
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            
-            # Install ChromeDriver
-            driver_path = ChromeDriverManager().install()
-            logger.info(f"ChromeDriver installed at: {driver_path}")
-            
-            # Initialize WebDriver
-            service = Service(driver_path)
-            context.driver = webdriver.Chrome(service=service, options=options)
-            context.driver.set_window_size(1280, 800)
-            context.driver.implicitly_wait(10)
-            logger.info("WebDriver initialized successfully")
-            
+            context.driver = context.browsers.acquire()
         except Exception as e:
             logger.error(f"Failed to initialize WebDriver: {str(e)}")
             raise
 
 def after_scenario(context, scenario):
     if hasattr(context, 'driver'):
-        logger.info("Cleaning up WebDriver")
-        try:
-            context.driver.quit()
-        except Exception as e:
-            logger.error(f"Error closing WebDriver: {str(e)}")
+        context.browsers.release(context.driver)
+        del context.driver
 
 def after_all(context):
     logger.info("Cleaning up test environment")
+    if hasattr(context, 'browsers'):
+        context.browsers.close()
     if hasattr(context, 'server'):
-        context.server.join(1)
+        context.server.shutdown()
+        context.server_thread.join(1)
+    shutil.rmtree(pdf_cache.directory, ignore_errors=True)
     # Pop app context if it was pushed
     if hasattr(context, 'app_context'):
         try:
@@ -0,0 +1,48 @@
+Feature: Ghostscript worker pool
+  Persistent gs workers are reused per compression level, recycled and replaced when they fail
+
+  Scenario: Jobs of one level reuse a worker
+    Given a Ghostscript pool of 2 workers recycled after 3 jobs
+    When the pool compresses 3 PDFs with level "ebook"
+    Then 1 Ghostscript workers should have started
+    And the "ebook" jobs should have run on 1 workers
+
+  Scenario: A full pool retires an idle worker of another level
+    Given a Ghostscript pool of 2 workers recycled after 3 jobs
+    When the pool compresses 1 PDFs with level "ebook"
+    And the pool compresses 1 PDFs with level "screen"
+    And the pool compresses 1 PDFs with level "printer"
+    Then 3 Ghostscript workers should have started
+    And the pool should have 2 idle workers
+
+  Scenario: Workers are recycled after their job limit
+    Given a Ghostscript pool of 2 workers recycled after 3 jobs
+    When the pool compresses 7 PDFs with level "ebook"
+    Then 3 Ghostscript workers should have started
+    And the "ebook" jobs should have run on 3 workers
+
+  Scenario: A worker whose job failed is not reused
+    Given a Ghostscript pool of 2 workers recycled after 3 jobs
+    When the pool compresses 1 PDFs with level "ebook"
+    And the pool compresses a broken PDF with level "ebook"
+    And the pool compresses 1 PDFs with level "ebook"
+    Then 2 Ghostscript workers should have started
+    And the pool should have 1 idle workers
+
+  Scenario: Compression falls back to a fresh Ghostscript when a worker fails
+    Given a fake Ghostscript that records its runs
+    And PDF compression uses 1 persistent Ghostscript workers
+    And the Ghostscript workers refuse every job
+    And the compressibility pre-scan is disabled
+    And the PDF cache is empty
+    And I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response content-type should be "application/pdf"
+    And the compressed PDF size should be greater than 0
+    And Ghostscript should have run 1 jobs on workers and 1 times on its own
+
+  Scenario: The installed Ghostscript runs consecutive jobs on one worker
+    Given a pool of 1 installed Ghostscript workers recycled after 3 jobs
+    When the pool compresses 2 PDFs with level "ebook"
+    And the pool compresses 1 PDFs with level "screen"
+    Then the pool should have 1 idle workers
@@ -18,3 +18,97 @@ Feature: Image conversion
     When I convert it to "png"
     Then the response content-type should be "image/png"
     And the response filename should end with ".png"
+
+
+  Scenario: Repeat conversion is served from the result cache
+    Given I have a PNG image
+    And the image cache is empty
+    When I convert it to "jpg"
+    Then the response header "X-Cache" should be "MISS"
+    When I convert it to "jpg"
+    Then the response header "X-Cache" should be "HIT"
+    And the response content-type should be "image/jpeg"
+
+  Scenario: Downscale while converting
+    Given I have a 1200x800 JPG image
+    When I request a "png" conversion with width "300"
+    Then the response content-type should be "image/png"
+    And the output image should be 300x200 pixels
+
+  Scenario: Several renditions from a single upload
+    Given I have a 1200x800 JPG image
+    When I request a "webp" conversion with widths "100,400,2000"
+    Then the response content-type should be "application/zip"
+    And the archive should contain "test-100.webp" at 100x67 pixels
+    And the archive should contain "test-400.webp" at 400x267 pixels
+    And the archive should contain "test-2000.webp" at 1200x800 pixels
+
+  Scenario: Repeated widths are produced once, smallest first
+    Given I have a 1200x800 JPG image
+    When I request a "webp" conversion with widths "400,100,400"
+    Then the response content-type should be "application/zip"
+    And the archive should hold "test-100.webp, test-400.webp"
+
+  Scenario: Too many widths are refused
+    Given I have a 1200x800 JPG image
+    When I request a "webp" conversion with widths "10,20,30,40,50,60,70,80,90"
+    Then the response status code should be 400
+
+  Scenario: Choose an encoder profile per request
+    Given I have a PNG image
+    When I request a "png" conversion with profile "fast"
+    Then the response content-type should be "image/png"
+
+  Scenario: Unknown encoder profiles are rejected
+    Given I have a PNG image
+    When I request a "png" conversion with profile "tiny"
+    Then the response status code should be 400
+
+  Scenario Outline: Transparency is flattened onto white for JPG
+    Given I have a fully transparent "<mode>" PNG image
+    When I convert it to "jpg"
+    Then the response content-type should be "image/jpeg"
+    And every pixel of the output image should be white
+
+    Examples:
+      | mode |
+      | RGBA |
+      | LA   |
+      | P    |
+
+  Scenario: Let the server pick the smallest format
+    Given I have a PNG image
+    When I convert it to "auto"
+    Then the response status code should be 200
+    And the response should have a "X-Image-Format" header
+
+  Scenario: Restrict the formats auto may choose from
+    Given I have a 1200x800 JPG image
+    When I request a "auto" conversion with formats "jpg"
+    Then the response header "X-Image-Format" should be "jpg"
+    And the response content-type should be "image/jpeg"
+
+  Scenario: Auto format returns its decode budget when a trial cannot be scheduled
+    Given I have a PNG image
+    And the image cache is empty
+    And format=auto can schedule only its first trial encode
+    When I convert it to "auto"
+    Then the response status code should be 500
+    And the image decode budget should be released
+
+  Scenario: Auto format does not produce renditions
+    Given I have a 1200x800 JPG image
+    When I request a "auto" conversion with widths "100,400"
+    Then the response status code should be 400
+
+  Scenario: Image uploads above the route limit are refused before they are read
+    Given image uploads are limited to 100 bytes
+    And I have a PNG image
+    When I convert it to "webp"
+    Then the response status code should be 413
+
+  Scenario: PDF uploads are not held to the image upload limit
+    Given image uploads are limited to 100 bytes
+    And I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response content-type should be "application/pdf"
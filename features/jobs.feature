@@ -0,0 +1,45 @@
+Feature: Background jobs
+  Long conversions can be submitted as jobs and collected when they finish
+
+  Scenario: Convert an image through the job API
+    Given I have a PNG image
+    When I submit a "convert-image" job with format "webp"
+    Then the response status code should be 202
+    And the job should finish with status "done"
+    And the job result content-type should be "image/webp"
+
+  Scenario: Merge PDFs through the job API
+    Given I have two generated PDF files
+    When I submit a "merge-pdf" job
+    Then the response status code should be 202
+    And the job should finish with status "done"
+    And the job result content-type should be "application/pdf"
+
+  Scenario: Unknown jobs are reported as missing
+    Given the application is running
+    When I request the status of job "does-not-exist"
+    Then the response status code should be 404
+
+  Scenario: Download part of a merged PDF with a Range request
+    Given I have two generated PDF files
+    When I submit a "merge-pdf" job
+    Then the job should finish with status "done"
+    And the first 100 bytes of the job result can be fetched with a Range request
+
+  Scenario: Any worker can report on a job
+    Given I have two generated PDF files
+    When I submit a "merge-pdf" job
+    Then the job should finish with status "done"
+    And another worker should report the job as "done"
+
+  Scenario: Failed jobs report their error
+    Given I have a PDF file that cannot be parsed
+    When I submit a "merge-pdf" job
+    Then the job should finish with status "failed"
+    And another worker should report the job as "failed"
+    And the job result should be an error mentioning the failure
+
+  Scenario: Directories of jobs that never finished are removed
+    Given a job directory was left behind 2 days ago
+    When I request the status of job "does-not-exist"
+    Then the abandoned job directory should have been removed
@@ -0,0 +1,55 @@
+Feature: Metrics
+  Request, stage and engine metrics are exposed in the Prometheus text format
+
+  Scenario: Image conversion stages are timed
+    Given I have a PNG image
+    And the image cache is empty
+    When I convert it to "jpg"
+    And I scrape the metrics
+    Then the response content-type should be "text/plain"
+    And the metrics should include "spotconvert_image_stage_seconds_count{stage="decode"}"
+    And the metrics should include "spotconvert_image_stage_seconds_count{stage="flatten"}"
+    And the metrics should include "spotconvert_image_stage_seconds_count{stage="encode"}"
+    And the metrics should include "spotconvert_requests_total{route="/convert-image",method="POST",status="200"}"
+    And the metrics should include "spotconvert_response_bytes_total{route="/convert-image"}"
+
+  Scenario: Merges record pages and time
+    Given I have two generated PDF files
+    When I merge them
+    And I scrape the metrics
+    Then the metrics should include "spotconvert_merge_pages_count"
+    And the metrics should include "spotconvert_merge_seconds_bucket{le="+Inf"}"
+    And the metrics should include "spotconvert_request_bytes_total{route="/merge-pdf"}"
+
+  Scenario: Conversions report a per-stage Server-Timing header
+    Given I have a PNG image
+    And the image cache is empty
+    When I convert it to "webp"
+    Then the Server-Timing header should list "upload, admit, cache, decode, flatten, encode, send, total"
+
+  Scenario: Merges report a per-stage Server-Timing header
+    Given I have two generated PDF files
+    And the PDF cache is empty
+    When I merge them
+    Then the Server-Timing header should list "upload, save, cache, append, write, send, total"
+
+  Scenario: Profile a single request as an admin
+    Given I have a PNG image
+    And the admin token is "s3cret"
+    When I request a profiled "jpg" conversion with admin token "s3cret"
+    Then the response status code should be 200
+    And the profile can be downloaded as text with admin token "s3cret"
+
+  Scenario: Only the newest profile dumps are kept
+    Given I have a PNG image
+    And the admin token is "s3cret"
+    And at most 2 profile dumps are kept
+    When I request 3 profiled "jpg" conversions with admin token "s3cret"
+    Then only the last 2 profiles can be downloaded with admin token "s3cret"
+
+  Scenario: Profiling is ignored without the admin token
+    Given I have a PNG image
+    And the admin token is "s3cret"
+    When I request a profiled "jpg" conversion with admin token "guess"
+    Then the response status code should be 200
+    And the response should not have a "X-Profile" header
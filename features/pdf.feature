@@ -12,3 +12,149 @@ Feature: PDF compression and merging
     When I merge them
     Then the response content-type should be "application/pdf"
     And the merged PDF size should be greater than 0
+    And the response Content-Length should match the body
+
+  Scenario: A merge upload that is not a PDF is refused with a JSON error
+    Given I have two generated PDF files
+    And the last of them is named "notes.txt"
+    When I merge them
+    Then the response status code should be 400
+    And the response should contain an error message
+
+  Scenario: Merging keeps each document's outline and named destinations
+    Given I have two PDF files with outlines and named destinations
+    When I merge them
+    Then the response content-type should be "application/pdf"
+    And the merged PDF outline should be "a top@1, a child@2, a last@3, b top@4, b child@5, b last@6"
+    And the merged PDF named destination "b-second" should point to page 5
+
+  Scenario: Merging PDFs whose pages share inherited resources
+    Given I have two PDF files whose pages inherit shared resources
+    When I merge them
+    Then the response status code should be 200
+    And every merged page should use the font "/Helvetica"
+
+
+  Scenario: Compress a PDF that is spooled to disk during upload
+    Given uploads larger than 100 bytes are spooled to disk
+    And I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response content-type should be "application/pdf"
+    And the compressed PDF size should be greater than 0
+    And no spooled uploads should remain
+
+  Scenario: Compress a PDF by piping it through Ghostscript
+    Given Ghostscript runs in "pipe" mode
+    And I have a generated PDF file
+    When I compress it with level "screen"
+    Then the response content-type should be "application/pdf"
+    And the compressed PDF size should be greater than 0
+
+  Scenario: Pipe mode times only the start of Ghostscript
+    Given a fake Ghostscript that records its runs
+    And Ghostscript runs in "pipe" mode
+    And I have a generated PDF file
+    When I compress it with level "screen"
+    Then the response content-type should be "application/pdf"
+    And the Server-Timing header should list "ghostscript-start"
+    And the Server-Timing header should not list "ghostscript"
+
+  Scenario Outline: Compress embedded images without Ghostscript
+    Given Ghostscript is not installed
+    And I have a PDF with a high-resolution photo
+    When I compress it with level "<level>"
+    Then the compression should be successful
+    And the output file should be smaller than input
+    And the PDF should be readable
+    And the PDF images should be at most <dpi> DPI
+    And the response header "X-Compression" should be "compressed"
+
+    Examples:
+      | level   | dpi |
+      | screen  | 72  |
+      | ebook   | 100 |
+      | printer | 150 |
+
+  Scenario: Compress a long PDF as parallel page ranges
+    Given Ghostscript shards PDFs into ranges of 5 pages
+    And I have a generated PDF file with 20 pages
+    When I compress it with level "ebook"
+    Then the response content-type should be "application/pdf"
+    And the compressed PDF should have 20 pages
+
+  Scenario: Long PDFs are compressed as one gs process per page range
+    Given a fake Ghostscript that records its runs
+    And Ghostscript shards PDFs into ranges of 5 pages
+    And the compressibility pre-scan is disabled
+    And the PDF cache is empty
+    And I have a generated PDF file with 20 pages
+    When I compress it with level "ebook"
+    Then the response content-type should be "application/pdf"
+    And the compressed PDF should have 20 pages
+    And Ghostscript should have run 4 times
+
+  Scenario: PDFs with an outline are compressed whole
+    Given a fake Ghostscript that records its runs
+    And Ghostscript shards PDFs into ranges of 5 pages
+    And the compressibility pre-scan is disabled
+    And the PDF cache is empty
+    And I have a generated PDF file with 20 pages and an outline
+    When I compress it with level "ebook"
+    Then the compressed PDF should have 20 pages
+    And Ghostscript should have run 1 times
+
+  Scenario: Sharded compressions share a bounded number of gs processes
+    Given a fake Ghostscript that records its runs
+    And Ghostscript shards PDFs into ranges of 5 pages
+    And 2 of the shard processes are busy
+    And the compressibility pre-scan is disabled
+    And the PDF cache is empty
+    And I have a generated PDF file with 20 pages
+    When I compress it with level "ebook"
+    Then the compressed PDF should have 20 pages
+    And Ghostscript should have run 2 times
+
+  Scenario: Shards are joined without duplicating shared images
+    When I join 3 compressed shards that share the same images
+    Then the joined PDF should hold each image once
+
+  Scenario: PDFs with nothing to compress are returned as uploaded
+    Given I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response header "X-Compression" should be "skipped"
+    And the compressed PDF should be identical to the upload
+
+  Scenario: Output that is not smaller is replaced by the upload
+    Given the compressibility pre-scan is disabled
+    And I have a generated PDF file
+    When I compress it with level "ebook"
+    Then the response header "X-Compression" should be "original"
+    And the compressed PDF should be identical to the upload
+
+  Scenario: Repeated compressions are served from the PDF cache
+    Given Ghostscript is not installed
+    And the PDF cache is empty
+    And I have a PDF with a high-resolution photo
+    When I compress it with level "screen"
+    Then the response header "X-Cache" should be "MISS"
+    When I compress it with level "screen"
+    Then the response header "X-Cache" should be "HIT"
+    And the response header "X-Compression" should be "compressed"
+    And the PDF images should be at most 72 DPI
+
+  Scenario: Repeated merges are served from the PDF cache
+    Given the PDF cache is empty
+    And I have two generated PDF files
+    When I merge them
+    Then the response header "X-Cache" should be "MISS"
+    When I merge them
+    Then the response header "X-Cache" should be "HIT"
+    And the response Content-Length should match the body
+
+  Scenario: The PDF cache evicts the least recently used entries
+    Given a PDF cache limited to 2500 bytes
+    When I store entry "a" of 1000 bytes in the cache
+    And I store entry "b" of 1000 bytes in the cache
+    And I read entry "a" from the cache
+    And I store entry "c" of 1000 bytes in the cache
+    Then the cache should hold entries "a,c"
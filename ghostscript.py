@@ -0,0 +1,340 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+# Map level to Ghostscript PDFSETTINGS
+SETTINGS_MAP = {
+    'screen': '/screen',   # lowest quality, smallest size
+    'ebook': '/ebook',     # medium quality
+    'printer': '/printer', # high quality
+    'prepress': '/prepress' # highest quality, least compression
+}
+
+# target DPI per level for explicit raster downsampling (prepress keeps full resolution)
+DPI_MAP = {'screen': 72, 'ebook': 100, 'printer': 150}
+
+
+class GhostscriptError(RuntimeError):
+    """Ghostscript failed; returncode is the process exit status, or None if gs is still running."""
+
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+def find_ghostscript():
+    """Locate the Ghostscript executable, or return None when it is not installed."""
+    return shutil.which('gswin64c') or shutil.which('gs') or shutil.which('gswin32c')
+
+
+def level_args(level):
+    """Return the pdfwrite switches for a compression level."""
+    pdf_setting = SETTINGS_MAP.get(level, '/ebook')
+    args = ['-dCompatibilityLevel=1.4', f'-dPDFSETTINGS={pdf_setting}']
+
+    # Add explicit downsampling parameters for non-prepress settings
+    if level in DPI_MAP:
+        dpi = DPI_MAP[level]
+        args += [
+            '-dDownsampleColorImages=true',
+            '-dDownsampleGrayImages=true',
+            '-dDownsampleMonoImages=true',
+            f'-dColorImageResolution={dpi}',
+            f'-dGrayImageResolution={dpi}',
+            f'-dMonoImageResolution={dpi}',
+            '-dColorImageDownsampleType=/Average',
+            '-dGrayImageDownsampleType=/Average'
+        ]
+    return args
+
+
+def compress(gs_exec, in_path, out_path, level, first_page=None, last_page=None, extra_args=()):
+    """Compress in_path to out_path with a one-shot Ghostscript process.
+
+    With first_page and last_page (1-based, inclusive) only that range is written.
+    """
+    gs_cmd = [gs_exec, '-sDEVICE=pdfwrite'] + level_args(level) + list(extra_args) + ['-dNOPAUSE', '-dBATCH']
+    if first_page is not None:
+        gs_cmd += [f'-dFirstPage={first_page}', f'-dLastPage={last_page}']
+    gs_cmd += [f'-sOutputFile={out_path}', in_path]
+
+    # Run Ghostscript and capture output for debugging
+    try:
+        subprocess.run(gs_cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as gs_err:
+        # include stderr for diagnosis
+        stderr = gs_err.stderr.decode('utf-8', errors='ignore') if gs_err.stderr else ''
+        raise GhostscriptError(f'Ghostscript failed (rc={gs_err.returncode}): {stderr}',
+                               gs_err.returncode) from gs_err
+
+
+def pipe_command(gs_exec, level, input_path='-'):
+    """Return a gs command line that reads input_path and writes the PDF to stdout."""
+    # Messages go to stderr so stdout carries nothing but the document
+    return [gs_exec, '-q', '-sDEVICE=pdfwrite'] + level_args(level) + [
+        '-dNOPAUSE', '-dBATCH', '-sstdout=%stderr', '-sOutputFile=-', input_path
+    ]
+
+
+class GhostscriptStream:
+    """Compress a PDF with one gs process and iterate over the output as gs writes it.
+
+    source is a path, read in place, or a binary file object. gs needs random access
+    to a PDF, so file objects are copied into an anonymous memfd where the platform has
+    one and otherwise fed on stdin (gs then spools them to its own temp file).
+
+    The first chunk is read up front, so a gs that fails without producing output
+    raises GhostscriptError from the constructor, before a response has started.
+    A failure after that raises at the end of iteration. `close()` must be called.
+    """
+
+    def __init__(self, gs_exec, source, level, chunk_size=64 * 1024):
+        self.chunk_size = chunk_size
+        self.returncode = None
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self._stderr = tempfile.TemporaryFile()
+        self._feeder = None
+
+        pass_fds = ()
+        stdin = subprocess.DEVNULL
+        if isinstance(source, str):
+            input_path = source
+        elif hasattr(os, 'memfd_create'):
+            fd = os.memfd_create('spotconvert-input')
+            with os.fdopen(os.dup(fd), 'wb') as f:
+                shutil.copyfileobj(source, f)
+            # gs opens /dev/fd/N afresh, so it gets its own offset at 0
+            input_path = f'/dev/fd/{fd}'
+            pass_fds = (fd,)
+        else:
+            input_path = '-'
+            stdin = subprocess.PIPE
+
+        try:
+            self.process = subprocess.Popen(
+                pipe_command(gs_exec, level, input_path),
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=self._stderr,
+                pass_fds=pass_fds
+            )
+        finally:
+            for fd in pass_fds:
+                os.close(fd)
+
+        if stdin == subprocess.PIPE:
+            # Feed stdin from a thread so a full stdout pipe cannot deadlock us
+            self._feeder = threading.Thread(target=self._feed, args=(source,), daemon=True)
+            self._feeder.start()
+
+        try:
+            self._first = self.process.stdout.read(self.chunk_size)
+            if not self._first:
+                self._finish()
+        except Exception:
+            self.close()
+            raise
+
+    def _feed(self, source):
+        try:
+            shutil.copyfileobj(source, self.process.stdin)
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _finish(self):
+        self.returncode = self.process.wait()
+        self.elapsed = time.perf_counter() - self.started
+        if self.returncode != 0:
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode('utf-8', errors='ignore')
+            raise GhostscriptError(f'Ghostscript failed (rc={self.returncode}): {stderr}', self.returncode)
+
+    def __iter__(self):
+        if self._first:
+            yield self._first
+            while True:
+                chunk = self.process.stdout.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+            self._finish()
+
+    def close(self):
+        if self.process.poll() is None:
+            # The client went away mid-stream
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self._stderr.close()
+        if self._feeder is not None:
+            self._feeder.join()
+
+
+def _ps_string(value):
+    """Quote a path as a PostScript string literal."""
+    escaped = value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return f'({escaped})'
+
+
+class GhostscriptWorker:
+    """A long-lived gs process that reads one PostScript job after another from stdin.
+
+    Each worker is started with the switches of a single compression level, so fonts,
+    resources and the pdfwrite device are initialised once and reused across jobs.
+    """
+
+    def __init__(self, gs_exec, level, workdir):
+        self.level = level
+        self.jobs_done = 0
+        workdir = os.path.join(os.path.abspath(workdir), '')
+        cmd = [gs_exec, '-q', '-sDEVICE=pdfwrite'] + level_args(level) + [
+            '-dNOPAUSE',
+            f'--permit-file-read={workdir}',
+            f'--permit-file-write={workdir}',
+            f'--permit-file-write={os.devnull}',
+            f'-sOutputFile={os.devnull}',
+            '-'
+        ]
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, in_path, out_path):
+        marker = uuid.uuid4().hex
+        # Point pdfwrite at the job's output, interpret the input, then switch back to the
+        # null device so the output file is closed and complete before we report back
+        program = (
+            f'<< /OutputFile {_ps_string(out_path)} >> setpagedevice\n'
+            f'{{ {_ps_string(in_path)} run }} stopped\n'
+            f'<< /OutputFile {_ps_string(os.devnull)} >> setpagedevice\n'
+            f'{{ (\\n{marker} FAIL\\n) }} {{ (\\n{marker} OK\\n) }} ifelse print flush\n'
+            'clear cleardictstack\n'
+        )
+        try:
+            self.process.stdin.write(program.encode('utf-8'))
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            rc = self.process.poll()
+            raise GhostscriptError(f'Ghostscript worker exited (rc={rc})', rc) from e
+
+        output = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                rc = self.process.poll()
+                raise GhostscriptError(f'Ghostscript worker exited (rc={rc}): ' + ''.join(output), rc)
+            text = line.decode('utf-8', errors='ignore')
+            if text.startswith(marker):
+                break
+            output.append(text)
+
+        self.jobs_done += 1
+        if text.split()[-1] != 'OK':
+            raise GhostscriptError('Ghostscript failed: ' + ''.join(output))
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+
+
+class GhostscriptPool:
+    """Bounded pool of persistent Ghostscript workers, recycled after max_jobs jobs each.
+
+    Workers hold pipes to this process, so a pool must not be shared across fork();
+    owners should create it lazily and compare `pid` with os.getpid() before reuse.
+    """
+
+    def __init__(self, gs_exec, size=2, max_jobs=50, workdir='.'):
+        self.gs_exec = gs_exec
+        self.size = size
+        self.max_jobs = max_jobs
+        self.workdir = workdir
+        self.pid = os.getpid()
+        self._idle = []
+        self._count = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self, level):
+        with self._cond:
+            while True:
+                for worker in self._idle:
+                    if worker.level == level:
+                        self._idle.remove(worker)
+                        return worker
+                if self._count < self.size:
+                    self._count += 1
+                    break
+                if self._idle:
+                    # At capacity with only other levels idle: retire one to make room
+                    self._idle.pop(0).close()
+                    break
+                self._cond.wait()
+        try:
+            return GhostscriptWorker(self.gs_exec, level, self.workdir)
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, broken=False):
+        with self._cond:
+            if broken or not worker.alive() or worker.jobs_done >= self.max_jobs:
+                self._count -= 1
+                worker.close()
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def warm(self, level):
+        """Start an idle worker for level ahead of the first job, if the pool has room."""
+        with self._cond:
+            if self._count >= self.size:
+                return
+            self._count += 1
+        try:
+            worker = GhostscriptWorker(self.gs_exec, level, self.workdir)
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+        self._release(worker)
+
+    def compress(self, in_path, out_path, level):
+        """Compress in_path to out_path; both must live under the pool's workdir."""
+        worker = self._acquire(level)
+        try:
+            worker.run(in_path, out_path)
+        except Exception:
+            # A failed job can leave interpreter state behind, so never reuse the worker
+            self._release(worker, broken=True)
+            raise
+        self._release(worker)
+
+    def close(self):
+        with self._cond:
+            for worker in self._idle:
+                worker.close()
+                self._count -= 1
+            self._idle = []
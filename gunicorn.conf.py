@@ -0,0 +1,41 @@
+"""Gunicorn settings for production: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Every setting can be overridden from the environment (see the names below) or on the
+gunicorn command line.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('SPOTCONVERT_BIND', '0.0.0.0:8000')
+
+# Conversions are CPU-bound, so one synchronous worker per core; more only adds
+# contention for the same cores and multiplies per-worker caches and gs processes
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'sync'
+
+# Import the app, Pillow plugins, PyPDF2 and the template, and run the warmup
+# conversions once in the master; forked workers share those pages copy-on-write
+preload_app = True
+
+# Recycle each worker after roughly this many requests to cap memory growth from
+# fragmentation; the jitter keeps workers from all restarting at once
+max_requests = int(os.environ.get('SPOTCONVERT_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('SPOTCONVERT_MAX_REQUESTS_JITTER', 100))
+
+# Large PDFs can take minutes in Ghostscript
+timeout = int(os.environ.get('SPOTCONVERT_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('SPOTCONVERT_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Ghostscript workers hold pipes to their parent, so each worker starts its own
+    import wsgi
+    wsgi.warm_worker()
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.shutdown_worker()
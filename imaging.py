@@ -0,0 +1,283 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from PIL import Image
+import io
+import threading
+import time
+
+# Normalize target format name for Pillow
+FORMAT_MAP = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'webp': 'WEBP'
+}
+
+MIMETYPE_MAP = {'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+
+# File extension used for each Pillow format when the server picks the format
+EXTENSION_MAP = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+# Named encoder profiles trading encode speed against output size; see
+# benchmarks/profiles.py and the README for measured numbers.
+PROFILES = {
+    'fast': {
+        'JPEG': {'quality': 85, 'optimize': False},
+        'WEBP': {'quality': 85, 'method': 0},
+        'PNG': {'compress_level': 1},
+    },
+    'balanced': {
+        'JPEG': {'quality': 85, 'optimize': True},
+        'WEBP': {'quality': 85},
+        # zlib's default level: PNG optimize costs ~9x the time for ~6% on photos
+        'PNG': {'compress_level': 6},
+    },
+    'smallest': {
+        # 4:2:0 chroma subsampling, progressive scan, and no ICC/EXIF payload
+        'JPEG': {'quality': 80, 'optimize': True, 'progressive': True, 'subsampling': 2,
+                 'icc_profile': None, 'exif': b''},
+        'WEBP': {'quality': 80, 'method': 6, 'icc_profile': None, 'exif': b''},
+        'PNG': {'optimize': True, 'icc_profile': None, 'exif': b''},
+    },
+}
+
+DEFAULT_PROFILE = 'balanced'
+
+
+def save_kwargs_for(pil_format, profile=DEFAULT_PROFILE):
+    """Return the Pillow encoder settings used for the given output format and profile."""
+    save_kwargs = {'format': pil_format}
+    save_kwargs.update(PROFILES[profile][pil_format])
+    return save_kwargs
+
+
+def fit_size(size, width=None, height=None):
+    """Scale size to fit within width x height, keeping aspect ratio and never upscaling."""
+    src_w, src_h = size
+    scale = 1.0
+    if width:
+        scale = min(scale, width / src_w)
+    if height:
+        scale = min(scale, height / src_h)
+    if scale >= 1.0:
+        return size
+    return (max(1, round(src_w * scale)), max(1, round(src_h * scale)))
+
+
+def _lap(timings, stage, start):
+    """Add the time since start to timings[stage] (when timings is a dict) and return now."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def _draft(image, size):
+    # JPEG can decode straight at 1/2, 1/4 or 1/8 scale when the target is that much
+    # smaller; the decoder never goes below size. A no-op for other formats.
+    if size != image.size:
+        image.draft(None, size)
+
+
+# Modes each encoder writes as-is; anything else is converted once before encoding
+_WRITABLE_MODES = {
+    'JPEG': ('L', 'RGB'),
+    'PNG': ('1', 'L', 'LA', 'I', 'P', 'RGB', 'RGBA'),
+    'WEBP': ('RGB', 'RGBA'),
+}
+
+# Pillow resizes these with nearest-neighbour whatever filter is asked for
+_NEAREST_ONLY_MODES = ('1', 'P')
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _flatten_palette(image):
+    # Composite the palette rather than the pixels: blend each entry's colour over white
+    # by its alpha, then expand to RGB in a single convert. Modifies image in place.
+    palette = image.getpalette('RGB')
+    entries = len(palette) // 3
+    transparency = image.info.pop('transparency')
+    if isinstance(transparency, int):
+        alphas = [0 if index == transparency else 255 for index in range(entries)]
+    else:
+        alphas = list(transparency[:entries]) + [255] * (entries - len(transparency))
+    image.putpalette([
+        (value * alpha + 255 * (255 - alpha) + 127) // 255
+        for index, alpha in enumerate(alphas)
+        for value in palette[3 * index:3 * index + 3]
+    ])
+    return image.convert('RGB')
+
+
+def _flatten(image):
+    """Composite an image with alpha over white, allocating only the RGB result."""
+    if image.mode == 'P':
+        return _flatten_palette(image)
+    if image.mode not in ('RGBA', 'LA'):
+        image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    # paste() blends RGBA and LA straight into RGB, taking the mask from their alpha band
+    background.paste(image, mask=image)
+    return background
+
+
+def _prepare(image, pil_format, resizing=False):
+    """Return image in a mode the encoder can write, converting at most once."""
+    if pil_format == 'JPEG' and _has_alpha(image):
+        # JPEG has no alpha channel
+        return _flatten(image)
+    if image.mode in _WRITABLE_MODES[pil_format] and not (resizing and image.mode in _NEAREST_ONLY_MODES):
+        return image
+    return image.convert('RGBA' if _has_alpha(image) else 'RGB')
+
+
+def _encode(image, save_kwargs):
+    # Pillow accepts format as separate arg or in kwargs; use save with kwargs
+    output = io.BytesIO()
+    image.save(output, **save_kwargs)
+    return output.getvalue()
+
+
+def _resize(image, size):
+    if size == image.size:
+        return image
+    return image.resize(size, Image.LANCZOS)
+
+
+def convert_image_data(source, pil_format, save_kwargs, width=None, height=None, timings=None):
+    """Convert an encoded image (bytes or file object) and return the encoded output bytes.
+
+    When width and/or height are given the output is scaled down to fit within them.
+    Seconds spent in each stage (decode, flatten, resize, encode) are added to timings.
+    """
+    start = time.perf_counter()
+    image = _open(source)
+    size = fit_size(image.size, width, height)
+    _draft(image, size)
+    image.load()
+    start = _lap(timings, 'decode', start)
+    image_out = _prepare(image, pil_format, resizing=size != image.size)
+    start = _lap(timings, 'flatten', start)
+    image_out = _resize(image_out, size)
+    start = _lap(timings, 'resize', start)
+    converted = _encode(image_out, save_kwargs)
+    _lap(timings, 'encode', start)
+    return converted
+
+
+def render_renditions(source, pil_format, save_kwargs, widths, timings=None):
+    """Decode the source once and return [(width, encoded bytes)] for each requested width."""
+    start = time.perf_counter()
+    image = _open(source)
+    sizes = {width: fit_size(image.size, width) for width in widths}
+    # Decode only as much resolution as the largest rendition needs
+    _draft(image, max(sizes.values()))
+    image.load()
+    start = _lap(timings, 'decode', start)
+    image_out = _prepare(image, pil_format, resizing=any(size != image.size for size in sizes.values()))
+    start = _lap(timings, 'flatten', start)
+    renditions = []
+    for width in widths:
+        resized = _resize(image_out, sizes[width])
+        start = _lap(timings, 'resize', start)
+        renditions.append((width, _encode(resized, save_kwargs)))
+        start = _lap(timings, 'encode', start)
+    return renditions
+
+
+def _call_when_all_done(futures, callback):
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            callback()
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _trial(image, pil_format, save_kwargs):
+    # Every trial needs an Image object of its own: save() keeps encoder state on the
+    # object, and flattening a palette edits it. A view sharing the decoded pixels is
+    # enough, except for the palette case, where copying P costs one byte per pixel.
+    if image.mode == 'P' and pil_format == 'JPEG' and _has_alpha(image):
+        image = image.copy()
+    else:
+        image = image._new(image.im)
+    return _encode(_prepare(image, pil_format), save_kwargs)
+
+
+def convert_image_auto(source, candidates, executor, width=None, height=None, time_budget=1.0, timings=None,
+                       settled=None):
+    """Encode the image in every candidate format concurrently and return the smallest.
+
+    candidates is a list of (pil_format, save_kwargs) and the result a (pil_format,
+    bytes) pair. Encodes still running after time_budget seconds are not waited for,
+    unless none has finished, in which case the first to finish wins. Pillow releases
+    the GIL while encoding, so executor should be a thread pool.
+
+    Trials that miss the budget keep running in the background; settled, if given, is
+    called once every trial that started has finished (or straight away if decoding fails),
+    also when the call raises.
+    """
+    start = time.perf_counter()
+    try:
+        image = _open(source)
+        size = fit_size(image.size, width, height)
+        _draft(image, size)
+        image.load()
+        start = _lap(timings, 'decode', start)
+        if size != image.size:
+            # Resize once for all candidates; flattening after resizing gives the same pixels
+            if image.mode in _NEAREST_ONLY_MODES:
+                image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+            image = _resize(image, size)
+            start = _lap(timings, 'resize', start)
+    except Exception:
+        if settled is not None:
+            settled()
+        raise
+
+    futures = {}
+    try:
+        for pil_format, save_kwargs in candidates:
+            futures[executor.submit(_trial, image, pil_format, save_kwargs)] = pil_format
+    finally:
+        # If a submit fails, settle once the trials that did start have finished
+        if settled is not None:
+            if futures:
+                _call_when_all_done(futures, settled)
+            else:
+                settled()
+    done, _ = wait(futures, timeout=time_budget)
+    if not done:
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+    results = [(len(future.result()), futures[future], future.result())
+               for future in done if future.exception() is None]
+    _lap(timings, 'encode', start)
+    if not results:
+        # Every finished trial failed; report the first failure
+        raise next(iter(done)).exception()
+    _, pil_format, converted = min(results, key=lambda result: result[0])
+    return pil_format, converted
+
+
+def convert_image_file(in_path, out_path, pil_format, save_kwargs):
+    """Convert the image at in_path and write the encoded result to out_path."""
+    with open(in_path, 'rb') as f:
+        converted = convert_image_data(f, pil_format, save_kwargs)
+    with open(out_path, 'wb') as f:
+        f.write(converted)
@@ -0,0 +1,218 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+
+_JOB_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class JobQueueFull(Exception):
+    """Raised when the number of unfinished jobs has reached the configured limit."""
+
+
+def _write_atomic(path, text):
+    # Readers in any process see either the old or the new contents, never a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_progress(path, fraction):
+    # Written to a side file so the web process can read progress from any worker process
+    _write_atomic(path, f'{fraction:.3f}')
+
+
+def _write_outcome(directory, error=None):
+    outcome = {'status': 'done' if error is None else 'failed', 'finished': time.time()}
+    if error is not None:
+        outcome['error'] = error
+    _write_atomic(os.path.join(directory, Job.OUTCOME), json.dumps(outcome))
+
+
+def _run_job(directory, func, args, report_progress):
+    """Entry point executed inside a pool process."""
+    progress_path = os.path.join(directory, Job.PROGRESS)
+    _write_progress(progress_path, 0.0)
+    kwargs = {}
+    if report_progress:
+        kwargs['progress'] = lambda fraction: _write_progress(progress_path, fraction)
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        _write_outcome(directory, str(e) or type(e).__name__)
+        raise
+    _write_progress(progress_path, 1.0)
+    _write_outcome(directory)
+
+
+class Job:
+    """A job as recorded in its directory, so that any worker process can report on it.
+
+    job.json holds what the job is, progress its completion fraction while it runs, and
+    outcome.json its final status once it has finished.
+    """
+
+    METADATA = 'job.json'
+    PROGRESS = 'progress'
+    OUTCOME = 'outcome.json'
+
+    def __init__(self, directory, kind, result_path, download_name, mimetype, created):
+        self.id = os.path.basename(directory)
+        self.kind = kind
+        self.directory = directory
+        self.result_path = result_path
+        self.download_name = download_name
+        self.mimetype = mimetype
+        self.created = created
+
+    @classmethod
+    def load(cls, directory):
+        """Return the job recorded in directory, or None if there is none."""
+        try:
+            with open(os.path.join(directory, cls.METADATA)) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(directory, info['kind'], os.path.join(directory, info['result']), info['download_name'],
+                   info['mimetype'], info['created'])
+
+    def save(self):
+        _write_atomic(os.path.join(self.directory, self.METADATA), json.dumps({
+            'kind': self.kind,
+            'result': os.path.relpath(self.result_path, self.directory),
+            'download_name': self.download_name,
+            'mimetype': self.mimetype,
+            'created': self.created
+        }))
+
+    def outcome(self):
+        """The finished job's {'status', 'finished', 'error'}, or None while it is unfinished."""
+        try:
+            with open(os.path.join(self.directory, self.OUTCOME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def progress(self):
+        try:
+            with open(os.path.join(self.directory, self.PROGRESS)) as f:
+                return float(f.read() or 0)
+        except (OSError, ValueError):
+            return 0.0
+
+    def to_dict(self):
+        outcome = self.outcome()
+        if outcome is not None:
+            status = outcome['status']
+        else:
+            status = 'running' if os.path.exists(os.path.join(self.directory, self.PROGRESS)) else 'queued'
+        info = {
+            'id': self.id,
+            'kind': self.kind,
+            'status': status,
+            'progress': 1.0 if status == 'done' else self.progress,
+            'created': self.created,
+            'finished': outcome['finished'] if outcome is not None else None
+        }
+        if status == 'failed':
+            info['error'] = outcome.get('error')
+        return info
+
+
+class JobManager:
+    """Runs conversions on a bounded process pool and keeps results on disk until they expire.
+
+    Each job lives in its own directory under root, which also records its status, so
+    any process sharing root can report on a job and serve its result. A job's directory
+    is removed ttl seconds after the job finishes. Directories of jobs that never finish,
+    for example because their worker was restarted, are removed max_age seconds after
+    they last changed. Purging runs lazily whenever the manager is used.
+    """
+
+    def __init__(self, root, max_workers=2, ttl=600, max_pending=100, max_age=86400):
+        self.root = root
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self._futures = {}  # unfinished jobs submitted by this process
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        os.makedirs(root, exist_ok=True)
+
+    def _get_executor(self):
+        # Pools cannot be shared with forked children, so each process gets its own
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def create_directory(self):
+        """Make a fresh job directory for the caller to save inputs into."""
+        directory = os.path.join(self.root, uuid.uuid4().hex)
+        os.makedirs(directory)
+        return directory
+
+    def submit(self, kind, directory, func, args, result_path, download_name, mimetype,
+               report_progress=False):
+        """Queue func(*args) in the pool; the job's output must be written to result_path."""
+        self.purge_expired()
+        job = Job(directory, kind, result_path, download_name, mimetype, time.time())
+        with self._lock:
+            pending = len(self._futures)
+            if pending >= self.max_pending:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise JobQueueFull(f'{pending} jobs already pending')
+            job.save()
+            future = self._get_executor().submit(_run_job, directory, func, args, report_progress)
+            self._futures[job.id] = future
+        future.add_done_callback(lambda future: self._finished(job, future))
+        return job
+
+    def _finished(self, job, future):
+        with self._lock:
+            self._futures.pop(job.id, None)
+        # A pool process that died, or a cancelled job, never wrote an outcome
+        if job.outcome() is None and os.path.isdir(job.directory):
+            error = 'cancelled' if future.cancelled() else str(future.exception())
+            _write_outcome(job.directory, error)
+
+    def get(self, job_id):
+        self.purge_expired()
+        if not _JOB_ID.fullmatch(job_id):
+            return None
+        return Job.load(os.path.join(self.root, job_id))
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            running = set(self._futures)
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name in running:
+                continue
+            try:
+                outcome_time = os.stat(os.path.join(entry.path, Job.OUTCOME)).st_mtime
+            except FileNotFoundError:
+                outcome_time = None
+            try:
+                if outcome_time is not None:
+                    expired = outcome_time + self.ttl < now
+                else:
+                    expired = entry.stat().st_mtime + self.max_age < now
+            except FileNotFoundError:
+                continue
+            if expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def shutdown(self):
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
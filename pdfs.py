@@ -0,0 +1,769 @@
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import (ArrayObject, ContentStream, DictionaryObject, IndirectObject, NameObject, NullObject,
+                            NumberObject, TextStringObject)
+from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextlib
+import copy
+import hashlib
+import io
+import math
+import mmap
+import os
+import re
+import shutil
+import time
+import ghostscript
+
+# JPEG quality for images re-encoded without Ghostscript; prepress keeps images as they are
+JPEG_QUALITY_MAP = {'screen': 50, 'ebook': 70, 'printer': 85}
+
+# Shards embed whole fonts rather than per-shard subsets, so identical font programs
+# can be shared when the shards are joined
+SHARD_ARGS = ('-dSubsetFonts=false',)
+
+# Like Ghostscript's DownsampleThreshold: leave images within 1.5x of the target resolution
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# Filters get_data() can undo, leaving raw samples
+_LOSSLESS_FILTERS = ('/FlateDecode', '/Fl', '/LZWDecode', '/LZW', '/ASCII85Decode', '/A85', '/ASCIIHexDecode', '/AHx')
+
+
+def _record(timings, stage, start):
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def compress_pdf_file(in_path, out_path, level, gs_exec=None, pool=None, timings=None, executor=None,
+                      shards=1, shard_pages=100, shard_slots=None):
+    """Compress the PDF at in_path into out_path and return the engine that was used.
+
+    Documents of at least 2 * shard_pages pages are split into up to shards page ranges,
+    each compressed by its own gs process. shard_slots, a semaphore, caps those processes
+    across calls: a call waits for one slot and shards only as far as further slots are
+    free. Without Ghostscript, embedded images are re-encoded on executor (a process
+    pool) if given, else in this process. Seconds spent in the engine are added to
+    timings under its name, even when it fails.
+    """
+    start = time.perf_counter()
+    # Attempt Ghostscript compression if available for better results
+    if gs_exec:
+        pages = _shardable_page_count(in_path) if shards > 1 else 0
+        wanted = min(shards, pages // shard_pages)
+        if wanted > 1:
+            taken = _take_slots(shard_slots, wanted) if shard_slots is not None else wanted
+            try:
+                if taken > 1:
+                    ranges = page_ranges(pages, taken, shard_pages)
+                    compress_pdf_sharded(gs_exec, in_path, out_path, level, ranges, timings)
+                    return 'ghostscript'
+            finally:
+                if shard_slots is not None:
+                    for _ in range(taken):
+                        shard_slots.release()
+            start = time.perf_counter()
+        try:
+            if pool is not None:
+                try:
+                    pool.compress(in_path, out_path, level)
+                except ghostscript.GhostscriptError:
+                    # A worker may be refused what a one-shot gs is allowed (switching
+                    # /OutputFile under -dSAFER), so retry once with a fresh process
+                    ghostscript.compress(gs_exec, in_path, out_path, level)
+            else:
+                ghostscript.compress(gs_exec, in_path, out_path, level)
+        finally:
+            _record(timings, 'ghostscript', start)
+        return 'ghostscript'
+
+    # Fallback: copy the pages with PyPDF2, downsampling and re-encoding embedded images.
+    # PdfReader copies a path into memory, so hand it a read-only mapping of the file instead.
+    with open(in_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        pdf_reader = PdfReader(mapped)
+        pdf_writer = PdfWriter()
+        for page in pdf_reader.pages:
+            pdf_writer.add_page(page)
+        if level in JPEG_QUALITY_MAP:
+            recompress_images(pdf_writer, level, executor)
+
+        with open(out_path, 'wb') as output:
+            try:
+                pdf_writer.write(output, compress_streams=True)
+            except TypeError:
+                pdf_writer.write(output)
+    _record(timings, 'pypdf2', start)
+    return 'pypdf2'
+
+
+# Stream dictionaries the pre-scan counts as room for compression: images (except
+# bilevel ones, which JBIG2 and CCITT already pack tightly) and embedded font programs
+_IMAGE_RE = re.compile(rb'/Subtype\s*/Image\b')
+_BILEVEL_RE = re.compile(rb'/(JBIG2Decode|CCITTFaxDecode|CCF)\b')
+_FONT_PROGRAM_RE = re.compile(rb'/Length1\b|/Subtype\s*/(Type1C|CIDFontType0C|OpenType)\b')
+_FILTER_RE = re.compile(rb'/Filter\b')
+
+# Stream dictionaries longer than this are not inspected
+_MAX_DICTIONARY = 4096
+
+
+def analyze_pdf(path):
+    """Estimate how many bytes of the PDF at path compression could work on.
+
+    Only the cross-reference table and the dictionary in front of each stream are read;
+    stream data is never decoded. An object's size is taken as the distance to the next
+    object. Counts images, embedded fonts and streams stored without a filter. Returns
+    (compressible bytes, file size).
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        reader = PdfReader(data)
+        offsets = sorted({offset for objects in reader.xref.values() for offset in objects.values()})
+        compressible = 0
+        for start, end in zip(offsets, offsets[1:] + [len(data)]):
+            head = data[start:min(end, start + _MAX_DICTIONARY)]
+            stream_at = head.find(b'stream')
+            if stream_at < 0:
+                continue
+            dictionary = head[:stream_at]
+            if _IMAGE_RE.search(dictionary):
+                if not _BILEVEL_RE.search(dictionary):
+                    compressible += end - start
+            elif _FONT_PROGRAM_RE.search(dictionary) or not _FILTER_RE.search(dictionary):
+                compressible += end - start
+        return compressible, len(data)
+
+
+def compress_pdf_smaller(in_path, out_path, level, min_share=0.0, **kwargs):
+    """Compress like compress_pdf_file, but never produce a file larger than in_path.
+
+    Returns (engine, outcome, share), where share is the fraction of the file the
+    pre-scan found compressible (None if it could not read the file; its seconds are
+    added to timings as 'prescan'), and outcome is one of:
+    - 'compressed': out_path holds the compressed PDF.
+    - 'skipped': share was below min_share, so nothing ran (engine is None).
+    - 'original': the output was not smaller than the input.
+    In the last two cases out_path holds a copy of the input.
+    """
+    start = time.perf_counter()
+    try:
+        compressible, size = analyze_pdf(in_path)
+        share = compressible / size if size else 0.0
+    except Exception:
+        share = None
+    _record(kwargs.get('timings'), 'prescan', start)
+    if share is not None and share < min_share:
+        shutil.copyfile(in_path, out_path)
+        return None, 'skipped', share
+
+    engine = compress_pdf_file(in_path, out_path, level, **kwargs)
+    if os.path.getsize(out_path) >= os.path.getsize(in_path):
+        shutil.copyfile(in_path, out_path)
+        return engine, 'original', share
+    return engine, 'compressed', share
+
+
+# Catalog entries a gs run over a page range cannot carry into the joined document
+_UNSHARDABLE_CATALOG_KEYS = ('/Outlines', '/AcroForm', '/Names', '/Dests')
+
+
+def _links_within(page):
+    """True if page has a link annotation pointing at a page of the same document."""
+    for annot in _get(page, '/Annots') or ():
+        annot = annot.get_object()
+        if _get(annot, '/Subtype') != '/Link':
+            continue
+        action = _get(annot, '/A')
+        if '/Dest' in annot or (action is not None and _get(action, '/S') == '/GoTo'):
+            return True
+    return False
+
+
+def _shardable_page_count(path):
+    """Number of pages in the PDF at path if it can be compressed in page ranges, else 0.
+
+    Outlines, form fields, named destinations and links between pages would be lost
+    when the ranges are joined, so documents with any of them count as 0, as do
+    documents PyPDF2 cannot read (gs may still manage them whole).
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            reader = PdfReader(mapped)
+            catalog = reader.trailer['/Root']
+            if any(key in catalog for key in _UNSHARDABLE_CATALOG_KEYS):
+                return 0
+            pages = reader.pages
+            if any(_links_within(page) for page in pages):
+                return 0
+            return len(pages)
+    except Exception:
+        return 0
+
+
+def _take_slots(slots, wanted):
+    """Acquire between 1 and wanted slots from a semaphore, waiting only for the first."""
+    slots.acquire()
+    taken = 1
+    while taken < wanted and slots.acquire(blocking=False):
+        taken += 1
+    return taken
+
+
+def page_ranges(pages, shards, shard_pages):
+    """Split pages into at most shards (first, last) ranges of at least shard_pages pages each."""
+    count = min(shards, pages // shard_pages)
+    if count < 2:
+        return [(1, pages)] if pages else []
+    bounds = [pages * index // count for index in range(count + 1)]
+    return [(bounds[index] + 1, bounds[index + 1]) for index in range(count)]
+
+
+def compress_pdf_sharded(gs_exec, in_path, out_path, level, ranges, timings=None):
+    """Compress each page range of in_path with its own gs process, then join them in order.
+
+    Work files go next to out_path. Seconds are added to timings under 'ghostscript' for
+    the parallel gs runs and 'reassemble' for the join.
+    """
+    parts = [f'{out_path}.part{index}' for index in range(len(ranges))]
+    try:
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [
+                    executor.submit(ghostscript.compress, gs_exec, in_path, part, level, first, last, SHARD_ARGS)
+                    for part, (first, last) in zip(parts, ranges)
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            _record(timings, 'ghostscript', start)
+        start = time.perf_counter()
+        join_pdf_parts(parts, out_path)
+        _record(timings, 'reassemble', start)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def join_pdf_parts(parts, out_path):
+    """Concatenate the pages of the PDFs at parts into out_path, storing identical objects once."""
+    writer = PdfWriter()
+    for index, part in enumerate(parts):
+        reader = PdfReader(part)
+        for page in reader.pages:
+            writer.add_page(page)
+        if index == 0 and reader.metadata:
+            writer.add_metadata(reader.metadata)
+    deduplicate_objects(writer)
+    with open(out_path, 'wb') as output:
+        writer.write(output)
+
+
+def _fingerprint(obj):
+    buf = io.BytesIO()
+    obj.write_to_stream(buf, None)
+    return hashlib.sha256(buf.getvalue()).digest()
+
+
+def _rewrite_references(obj, replace):
+    """Point every indirect reference inside obj whose number is in replace at its replacement."""
+    items = obj.items() if isinstance(obj, DictionaryObject) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            if value.idnum in replace:
+                obj[key] = IndirectObject(replace[value.idnum], 0, value.pdf)
+        elif isinstance(value, (DictionaryObject, ArrayObject)):
+            _rewrite_references(value, replace)
+
+
+def _references(obj, found=None):
+    """Numbers of the objects obj refers to, directly or through nested dictionaries and arrays."""
+    found = set() if found is None else found
+    for value in (obj.values() if isinstance(obj, DictionaryObject) else obj):
+        if isinstance(value, IndirectObject):
+            found.add(value.idnum)
+        elif isinstance(value, (DictionaryObject, ArrayObject)):
+            _references(value, found)
+    return found
+
+
+def deduplicate_objects(writer):
+    """Store each set of byte-identical objects in writer once.
+
+    Every shard carries its own copy of shared fonts, images and colour profiles. Once
+    duplicate streams are merged, the dictionaries that referred to them (font
+    descriptors, say) become identical too, so this repeats until nothing changes.
+    Each pass only fingerprints the objects whose references the previous pass
+    rewrote. Duplicates are replaced by null, since PyPDF2 3.0 cannot leave gaps in the
+    object numbering.
+    """
+    objects = writer._objects
+    # The trailer refers to the info dictionary by number
+    keep = {writer._info.idnum}
+    referrers = {}
+    candidates = []
+    for index, obj in enumerate(objects):
+        idnum = index + 1
+        if not isinstance(obj, (DictionaryObject, ArrayObject)):
+            continue
+        for target in _references(obj):
+            referrers.setdefault(target, set()).add(idnum)
+        # Pages must stay distinct objects even when they look alike
+        if idnum in keep or (isinstance(obj, DictionaryObject) and
+                             _get(obj, '/Type') in ('/Page', '/Pages', '/Catalog')):
+            continue
+        candidates.append(idnum)
+
+    seen = {}
+    fingerprints = {}
+    replace = {}
+    while candidates:
+        found = {}
+        for idnum in candidates:
+            if idnum in replace:
+                continue
+            # An object whose references changed no longer looks like its old self
+            previous = fingerprints.get(idnum)
+            if previous is not None and seen.get(previous) == idnum:
+                del seen[previous]
+            fingerprint = fingerprints[idnum] = _fingerprint(objects[idnum - 1])
+            first = seen.setdefault(fingerprint, idnum)
+            if first != idnum:
+                found[idnum] = first
+        if not found:
+            break
+        replace.update(found)
+        changed = set()
+        for duplicate, first in found.items():
+            moved = referrers.pop(duplicate, set())
+            referrers.setdefault(first, set()).update(moved)
+            changed |= moved
+        changed -= set(replace)
+        for idnum in changed:
+            _rewrite_references(objects[idnum - 1], found)
+        candidates = sorted(idnum for idnum in changed if fingerprints.get(idnum) is not None)
+    for idnum in replace:
+        objects[idnum - 1] = NullObject()
+    return len(replace)
+
+
+def _get(dictionary, key):
+    return dictionary[key] if key in dictionary else None
+
+
+def _image_mode(image):
+    """Pillow mode to re-encode an image XObject in, or None if it must be left alone."""
+    # Stencil and colour-key masks, decode arrays and odd bit depths do not survive JPEG
+    if _get(image, '/ImageMask') or '/Mask' in image or '/Decode' in image:
+        return None
+    if _get(image, '/BitsPerComponent') != 8:
+        return None
+    colorspace = _get(image, '/ColorSpace')
+    if isinstance(colorspace, ArrayObject) and len(colorspace) == 2 and colorspace[0] == '/ICCBased':
+        return {1: 'L', 3: 'RGB'}.get(_get(colorspace[1].get_object(), '/N'))
+    return {'/DeviceGray': 'L', '/DeviceRGB': 'RGB'}.get(colorspace)
+
+
+def _image_source(image):
+    """Return ('jpeg', JPEG bytes) or ('raw', samples) for an image, or None if its filters are unsupported."""
+    filters = _get(image, '/Filter')
+    if filters is None:
+        filters = []
+    elif not isinstance(filters, ArrayObject):
+        filters = [filters]
+    *outer, last = filters or [None]
+    if not all(name in _LOSSLESS_FILTERS for name in outer):
+        return None
+    # get_data() undoes every filter but DCTDecode, which it passes through
+    if last in ('/DCTDecode', '/DCT'):
+        return 'jpeg', image.get_data()
+    if last is None or last in _LOSSLESS_FILTERS:
+        return 'raw', image.get_data()
+    return None
+
+
+def _multiply(m, n):
+    return [
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def _drawn_sizes(page, names):
+    """Largest (width, height) in points at which each of names is drawn by page's content.
+
+    Images the content does not draw directly (inside a form, say) are missing from the
+    result. Raises if the content cannot be parsed.
+    """
+    sizes = {}
+    contents = page.get_contents()
+    if contents is None:
+        return sizes
+    ctm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    for operands, operator in ContentStream(contents, page.indirect_reference.pdf).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q' and stack:
+            ctm = stack.pop()
+        elif operator == b'cm':
+            ctm = _multiply([float(value) for value in operands], ctm)
+        elif operator == b'Do' and operands[0] in names:
+            # An image fills the unit square, so the CTM's column lengths are its size on the page
+            width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+            previous = sizes.get(operands[0], (0, 0))
+            sizes[operands[0]] = (max(previous[0], width), max(previous[1], height))
+    return sizes
+
+
+def _page_images(writer):
+    """Yield (image, (width, height) drawn in points) for each image XObject use on each page."""
+    for page in writer.pages:
+        resources = _get(page, '/Resources')
+        xobjects = _get(resources, '/XObject') if resources is not None else None
+        if not xobjects:
+            continue
+        names = {name for name in xobjects if _get(xobjects[name], '/Subtype') == '/Image'}
+        if not names:
+            continue
+        # No image needs more pixels than it would take to cover the page
+        box = page.mediabox
+        bound = max(float(box.width), float(box.height))
+        try:
+            drawn = _drawn_sizes(page, names)
+        except Exception:
+            drawn = {}
+        for name in names:
+            yield xobjects.raw_get(name), drawn.get(name, (bound, bound))
+
+
+def recompress_image(kind, data, mode, size, target_size, quality):
+    """Decode one embedded image, downsample it to target_size and return it as JPEG.
+
+    Returns None when the data does not match the image's declared size and mode.
+    """
+    if kind == 'jpeg':
+        image = Image.open(io.BytesIO(data))
+        image.draft(mode, target_size)
+    else:
+        if len(data) < size[0] * size[1] * len(mode):
+            return None
+        image = Image.frombuffer(mode, size, data, 'raw', mode, 0, 1)
+    if image.mode != mode:
+        image = image.convert(mode)
+    if image.size != target_size:
+        # Box filtering averages the source pixels, like Ghostscript's /Average downsampling
+        image = image.resize(target_size, Image.BOX)
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def recompress_images(writer, level, executor=None):
+    """Downsample the images in writer's pages to the level's DPI and re-encode them as JPEG.
+
+    Text and vector content are left as they are. Each image is processed once, at the
+    largest size any page draws it, and only replaced when the result is smaller.
+    """
+    dpi = ghostscript.DPI_MAP[level]
+    quality = JPEG_QUALITY_MAP[level]
+    drawn = {}
+    for ref, size in _page_images(writer):
+        previous = drawn.get(ref.idnum, (ref, (0, 0)))[1]
+        drawn[ref.idnum] = (ref, (max(previous[0], size[0]), max(previous[1], size[1])))
+
+    def jobs():
+        for ref, (width, height) in drawn.values():
+            image = ref.get_object()
+            mode = _image_mode(image)
+            try:
+                source = _image_source(image) if mode is not None else None
+            except Exception:
+                source = None
+            if source is None:
+                continue
+            size = (int(image['/Width']), int(image['/Height']))
+            # Pixels needed to show the image at the target DPI, in both directions
+            scale = max(width * dpi / 72 / size[0], height * dpi / 72 / size[1])
+            if scale * DOWNSAMPLE_THRESHOLD >= 1:
+                scale = 1
+            target_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+            if source[0] == 'jpeg' and target_size == size:
+                # Already a JPEG at a fitting size; at most drop any ASCII wrapping
+                _replace(image, source[1], size)
+                continue
+            yield image, (source[0], source[1], mode, size, target_size, quality)
+
+    for image, args, encoded in _run_jobs(jobs(), executor):
+        if encoded is not None:
+            _replace(image, encoded, args[4])
+
+
+def _replace(image, jpeg, size):
+    """Store JPEG data as the image's only content, unless that would make it bigger."""
+    if len(jpeg) >= len(image._data):
+        return
+    image._data = jpeg
+    image.decoded_self = None
+    image[NameObject('/Filter')] = NameObject('/DCTDecode')
+    image[NameObject('/Width')] = NumberObject(size[0])
+    image[NameObject('/Height')] = NumberObject(size[1])
+    if '/DecodeParms' in image:
+        del image['/DecodeParms']
+
+
+def _run_jobs(jobs, executor):
+    """Yield (image, args, JPEG bytes or None) for each job, keeping a few in flight on executor."""
+    if executor is None:
+        for image, args in jobs:
+            try:
+                yield image, args, recompress_image(*args)
+            except Exception:
+                yield image, args, None
+        return
+
+    # Decoded samples are held until their job is done, so bound how many are pending
+    max_in_flight = 2 * (os.cpu_count() or 2)
+    pending = {}
+    jobs = iter(jobs)
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < max_in_flight:
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+            else:
+                pending[executor.submit(recompress_image, *job[1])] = job
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            image, args = pending.pop(future)
+            yield image, args, None if future.exception() else future.result()
+
+
+class _ObjectWriter:
+    """Writes a PDF one object at a time, so nothing but the xref offsets is kept."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = []  # by object number - 1; None until the object is written
+        stream.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+
+    def reserve(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def ref(self, idnum):
+        return IndirectObject(idnum, 0, None)
+
+    def write(self, idnum, obj):
+        self.offsets[idnum - 1] = self.stream.tell()
+        self.stream.write(f'{idnum} 0 obj\n'.encode())
+        (NullObject() if obj is None else obj).write_to_stream(self.stream, None)
+        self.stream.write(b'\nendobj\n')
+
+    def finish(self, root_id):
+        xref = self.stream.tell()
+        self.stream.write(f'xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in self.offsets:
+            self.stream.write(f'{offset:010d} 00000 n \n'.encode())
+        self.stream.write(f'trailer\n<< /Size {len(self.offsets) + 1} /Root {root_id} 0 R >>\n'
+                          f'startxref\n{xref}\n%%EOF\n'.encode())
+
+
+class _MergeState:
+    """What the merged document needs from every source once their objects are written."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pages_id = writer.reserve()
+        self.catalog_id = writer.reserve()
+        self.kids = []
+        self.dests = {}  # name: rewritten destination, first source wins
+        self.outline_id = None
+        self.outline_first = None
+        self.outline_last = None  # (id, item) of the previous source's last top-level item, not yet written
+        self.outline_count = 0
+
+
+def _page_tree_nodes(node, seen):
+    """Yield the indirect references of every /Pages node below node (a reference)."""
+    if not isinstance(node, IndirectObject) or (node.idnum, node.generation) in seen:
+        return
+    seen.add((node.idnum, node.generation))
+    yield node
+    for kid in node.get_object().get('/Kids', ()):
+        if isinstance(kid, IndirectObject) and kid.get_object().get('/Type') != '/Page':
+            yield from _page_tree_nodes(kid, seen)
+
+
+def _named_dests(catalog):
+    """Yield (name, destination) from the catalog's /Dests dictionary and /Names /Dests tree."""
+    old = catalog.get('/Dests')
+    if old is not None:
+        for name, dest in old.get_object().items():
+            yield name[1:], dest
+    names = catalog.get('/Names')
+    tree = names.get_object().get('/Dests') if names is not None else None
+    stack = [tree] if tree is not None else []
+    while stack:
+        node = stack.pop().get_object()
+        stack.extend(node.get('/Kids', ()))
+        pairs = node.get('/Names', ())
+        for index in range(0, len(pairs) - 1, 2):
+            yield str(pairs[index].get_object()), pairs[index + 1]
+
+
+def _copy_source(reader, state):
+    """Write the pages of reader, with everything they reference, to state.writer.
+
+    Object numbers are reassigned as objects are reached from the pages. References
+    to the source's catalog and page tree point at the merged ones instead, so only
+    the pages and what they use are copied. The outline and named destinations are
+    carried over too.
+    """
+    writer = state.writer
+    ids = {}
+    queue = []
+
+    def ref(indirect):
+        key = (indirect.idnum, indirect.generation)
+        if key not in ids:
+            ids[key] = writer.reserve()
+            queue.append(indirect)
+        return writer.ref(ids[key])
+
+    def rewrite(obj):
+        # Build new containers rather than editing the reader's: a direct object
+        # shared by several parents (say /Resources inherited from /Pages) would
+        # otherwise be rewritten again with its references already renumbered.
+        if isinstance(obj, IndirectObject):
+            return ref(obj)
+        if isinstance(obj, DictionaryObject):
+            copied = copy.copy(obj)
+            for key, value in obj.items():
+                copied[key] = rewrite(value)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(rewrite(value) for value in obj)
+        return obj
+
+    root = reader.trailer.raw_get('/Root')
+    catalog = root.get_object()
+    if isinstance(root, IndirectObject):
+        ids[(root.idnum, root.generation)] = state.catalog_id
+    for node in _page_tree_nodes(catalog.get('/Pages'), set()):
+        ids[(node.idnum, node.generation)] = state.pages_id
+
+    pages = []
+    for page in reader.pages:
+        idnum = writer.reserve()
+        if page.indirect_reference is not None:
+            ids[(page.indirect_reference.idnum, page.indirect_reference.generation)] = idnum
+        pages.append((idnum, page))
+        state.kids.append(idnum)
+
+    # Top-level outline items are chained to the previous source's
+    outline = catalog.get('/Outlines')
+    outline = outline.get_object() if outline is not None else None
+    first = last = None
+    if outline is not None and isinstance(outline.get('/First'), IndirectObject):
+        if state.outline_id is None:
+            state.outline_id = writer.reserve()
+        outline_ref = catalog.raw_get('/Outlines')
+        if isinstance(outline_ref, IndirectObject):
+            ids[(outline_ref.idnum, outline_ref.generation)] = state.outline_id
+        first = rewrite(outline.raw_get('/First')).idnum
+        last = rewrite(outline.raw_get('/Last')).idnum
+        if state.outline_first is None:
+            state.outline_first = first
+        state.outline_count += int(outline.get('/Count', 0))
+    previous = state.outline_last
+    if first is not None and previous is not None:
+        previous[1][NameObject('/Next')] = writer.ref(first)
+        writer.write(*previous)
+        state.outline_last = None
+
+    for name, dest in _named_dests(catalog):
+        if name not in state.dests:
+            state.dests[name] = rewrite(dest)
+
+    for idnum, page in pages:
+        page.pop('/Parent', None)
+        page = rewrite(page)
+        page[NameObject('/Parent')] = writer.ref(state.pages_id)
+        writer.write(idnum, page)
+    while queue:
+        indirect = queue.pop()
+        idnum = ids[(indirect.idnum, indirect.generation)]
+        obj = rewrite(indirect.get_object())
+        if idnum == first and previous is not None:
+            obj[NameObject('/Prev')] = writer.ref(previous[0])
+        if idnum == last:
+            state.outline_last = (idnum, obj)
+        else:
+            writer.write(idnum, obj)
+
+
+def _finish_merge(state):
+    writer = state.writer
+    pages = DictionaryObject({
+        NameObject('/Type'): NameObject('/Pages'),
+        NameObject('/Kids'): ArrayObject(writer.ref(idnum) for idnum in state.kids),
+        NameObject('/Count'): NumberObject(len(state.kids)),
+    })
+    writer.write(state.pages_id, pages)
+    catalog = DictionaryObject({
+        NameObject('/Type'): NameObject('/Catalog'),
+        NameObject('/Pages'): writer.ref(state.pages_id),
+    })
+    if state.outline_last is not None:
+        writer.write(*state.outline_last)
+    if state.outline_id is not None:
+        writer.write(state.outline_id, DictionaryObject({
+            NameObject('/Type'): NameObject('/Outlines'),
+            NameObject('/First'): writer.ref(state.outline_first),
+            NameObject('/Last'): writer.ref(state.outline_last[0]),
+            NameObject('/Count'): NumberObject(state.outline_count),
+        }))
+        catalog[NameObject('/Outlines')] = writer.ref(state.outline_id)
+    if state.dests:
+        # A single leaf holding every name, sorted as name trees must be
+        names = ArrayObject()
+        for name in sorted(state.dests):
+            names.extend([TextStringObject(name), state.dests[name]])
+        dests_id = writer.reserve()
+        writer.write(dests_id, DictionaryObject({NameObject('/Names'): names}))
+        catalog[NameObject('/Names')] = DictionaryObject({NameObject('/Dests'): writer.ref(dests_id)})
+    writer.write(state.catalog_id, catalog)
+    writer.finish(state.catalog_id)
+
+
+def merge_pdf_files(sources, output, progress=None, timings=None):
+    """Append each source (path or file object) in order, write the result to output and
+    return its page count. Seconds spent copying and finishing are added to timings.
+
+    Sources are read one at a time and their objects written out as they are copied,
+    so memory use is bounded by the largest source rather than by their total size.
+    """
+    with contextlib.ExitStack() as stack:
+        stream = output if hasattr(output, 'write') else stack.enter_context(open(output, 'wb'))
+        state = _MergeState(_ObjectWriter(stream))
+        start = time.perf_counter()
+        for index, source in enumerate(sources):
+            with contextlib.ExitStack() as source_stack:
+                if not hasattr(source, 'read'):
+                    source = source_stack.enter_context(open(source, 'rb'))
+                reader = PdfReader(source)
+                _copy_source(reader, state)
+                # Objects point back at their reader, so break the cycle rather than wait for the collector
+                reader.resolved_objects.clear()
+                reader.flattened_pages = None
+            if progress is not None:
+                progress((index + 1) / (len(sources) + 1))
+        _record(timings, 'append', start)
+        start = time.perf_counter()
+        _finish_merge(state)
+        _record(timings, 'write', start)
+    return len(state.kids)
@@ -0,0 +1,77 @@
+"""Run the behave suite in parallel: feature files are sharded across worker processes.
+
+Each shard is a separate `behave` process with its own app server port, so shards
+share nothing but the upload folder (whose per-request files have unique names).
+Feature files are balanced by scenario count, largest first. Shard output is printed
+as each shard finishes, and the exit status is non-zero if any shard failed.
+
+Usage: python run_tests.py [--workers N] [--base-port 5100] [behave args...]
+  e.g. python run_tests.py --workers 4 --tags='not @ui' --tags='not @acceptance'
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+FEATURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'features')
+
+
+def scenario_count(path):
+    with open(path, encoding='utf-8') as f:
+        # An outline counts once; it is still a fair proxy for a file's run time
+        return sum(1 for line in f if line.strip().startswith(('Scenario:', 'Scenario Outline:')))
+
+
+def shard(paths, workers):
+    """Split paths into at most workers lists with roughly equal scenario counts."""
+    shards = [[] for _ in range(min(workers, len(paths)))]
+    loads = [0] * len(shards)
+    for count, path in sorted(((scenario_count(p), p) for p in paths), reverse=True):
+        index = loads.index(min(loads))
+        shards[index].append(path)
+        loads[index] += count
+    return shards
+
+
+def run_shard(index, paths, port, behave_args):
+    env = dict(os.environ, SPOTCONVERT_TEST_PORT=str(port))
+    cmd = [sys.executable, '-m', 'behave', *behave_args, *paths]
+    start = time.perf_counter()
+    result = subprocess.run(cmd, cwd=os.path.dirname(FEATURES), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return index, result.returncode, result.stdout, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='parallel behave processes')
+    parser.add_argument('--base-port', type=int, default=5100, help='shard N serves the app on this port + N')
+    args, behave_args = parser.parse_known_args()
+
+    paths = sorted(glob.glob(os.path.join(FEATURES, '*.feature')))
+    shards = shard(paths, max(1, args.workers))
+    start = time.perf_counter()
+    failed = []
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(run_shard, index, paths, args.base_port + index, behave_args)
+            for index, paths in enumerate(shards)
+        ]
+        for future in as_completed(futures):
+            index, returncode, output, elapsed = future.result()
+            names = ', '.join(os.path.basename(p) for p in shards[index])
+            print(f'=== shard {index} ({names}): exit {returncode} in {elapsed:.1f}s')
+            print(output)
+            if returncode != 0:
+                failed.append(index)
+
+    print(f'{len(shards)} shards in {time.perf_counter() - start:.1f}s; '
+          f'{"failed: " + ", ".join(map(str, sorted(failed))) if failed else "all passed"}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Importing this module loads everything a request would otherwise load lazily, so with
+preload_app the work happens once in the master and is shared by every forked worker.
+"""
+import io
+
+import PyPDF2  # noqa: F401  (imported before fork so workers share it)
+from PIL import Image
+
+from app import FORMAT_MAP, app, ghostscript_pool, save_kwargs_for, shutdown_pools
+from imaging import convert_image_data
+
+
+def preload():
+    """Import every Pillow plugin and compile the page template."""
+    Image.init()
+    with app.app_context():
+        app.jinja_env.get_template('index.html')
+
+
+def warmup():
+    """Run one small conversion into each output format.
+
+    The first encode of a format pulls in its codec module and initialises encoder
+    tables; doing it here keeps that cost out of the first user request.
+    """
+    sample = io.BytesIO()
+    Image.new('RGBA', (64, 64), (40, 160, 90, 128)).save(sample, format='PNG')
+    for pil_format in sorted(set(FORMAT_MAP.values())):
+        convert_image_data(sample.getvalue(), pil_format, save_kwargs_for(pil_format))
+
+
+def warm_worker():
+    """Per-process warmup run after fork: start this worker's Ghostscript processes."""
+    pool = ghostscript_pool()
+    if pool is not None:
+        pool.warm('ebook')
+
+
+def shutdown_worker():
+    """Stop this worker's Ghostscript processes and process pools before it exits."""
+    shutdown_pools()
+
+
+preload()
+warmup()